@@ -3,29 +3,68 @@ CuzoNet Manager - Sistema de Gestión de Clientes ISP
 Con funciones avanzadas: Pagos, Corte por Address List, Importar/Exportar Excel
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, send_from_directory, g, has_request_context, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import joinedload, selectinload, load_only
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from io import BytesIO
 import os
 import json
+import ipaddress
+import sqlite3
+import tempfile
+import functools
+import operator
 import zipfile
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import google.generativeai as genai
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Los routers usan certificados autofirmados: silenciar el aviso una sola vez
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
 # Configuración de Gemini AI
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask basado en orjson; jsonify() lo usa de forma transparente"""
+    _OPCIONES = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        # indent u otras opciones de json.dumps (modo debug): usar el proveedor por defecto
+        kwargs.pop('separators', None)
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        # datetime/Decimal/UUID siguen pasando por el default de Flask (mismo formato que antes)
+        return orjson.dumps(obj, default=self.default, option=self._OPCIONES).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'cuzonet-secret-key-2024')
 
 # Configuración de base de datos
@@ -38,10 +77,61 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_pre_ping': True,        # Verifica conexión antes de usarla (evita errores de conexión caída)
     'pool_recycle': 300,          # Recicla conexiones cada 5 min (evita timeouts del servidor)
     'connect_args': {'timeout': 30} if DATABASE_URL.startswith('sqlite') else {},
+    # INSERT masivos (import/restore) en sentencias de hasta 1000 filas: acota el tamaño de cada INSERT
+    'insertmanyvalues_page_size': int(os.getenv('DB_INSERT_PAGE_SIZE', 1000)),
 }
+if not DATABASE_URL.startswith('sqlite'):
+    # Pool dimensionado para gunicorn con hilos (ver Procfile: 8 threads por worker)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update({
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': 30,
+    })
 
 db = SQLAlchemy(app)
 
+if DATABASE_URL.startswith('sqlite'):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, 'connect')
+    def _sqlite_pragmas(dbapi_conn, _record):
+        """synchronous es por conexión: con WAL, NORMAL evita un fsync en cada commit"""
+        cur = dbapi_conn.cursor()
+        cur.execute('PRAGMA synchronous=NORMAL')
+        cur.close()
+
+# ============== FORMATO DE FECHAS ==============
+# f-strings en lugar de strftime(): se llaman por cada fila serializada en to_dict()
+def _fmt_d(d):
+    """'YYYY-MM-DD' o None"""
+    return None if d is None else f"{d.year:04d}-{d.month:02d}-{d.day:02d}"
+
+def _fmt_dt(d):
+    """'YYYY-MM-DD HH:MM' o None"""
+    return None if d is None else f"{d.year:04d}-{d.month:02d}-{d.day:02d} {d.hour:02d}:{d.minute:02d}"
+
+def _fmt_dts(d):
+    """'YYYY-MM-DD HH:MM:SS' o None"""
+    return None if d is None else f"{d.year:04d}-{d.month:02d}-{d.day:02d} {d.hour:02d}:{d.minute:02d}:{d.second:02d}"
+
+# ============== RESPUESTAS JSON ==============
+def json_response(data, status=200):
+    """Serializa con orjson (más rápido en listas grandes); si no está instalado usa jsonify"""
+    if orjson is None:
+        return jsonify(data), status
+    return Response(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS), status=status, mimetype='application/json')
+
+def json_archivo(data):
+    """JSON indentado en bytes UTF-8 (archivos de backup); orjson si está disponible"""
+    if orjson is None:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+    return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+def leer_json(datos):
+    """Parsea JSON desde bytes UTF-8"""
+    return json.loads(datos.decode('utf-8')) if orjson is None else orjson.loads(datos)
+
 # ============== CALCULO DE DEUDA DE CLIENTES ==============
 def calcular_meses_atrasados(cliente, mes_str=None):
     """Calcula cuántos meses completos han pasado desde la fecha_proximo_pago hasta el mes a cobrar."""
@@ -67,6 +157,100 @@ def calcular_deuda_total(cliente, mes_str=None):
     # La deuda es: saldo anterior + (meses atrasados * cuota)
     return saldo_base + (meses * cuota)
 
+def sumar_meses(anio, mes, n):
+    """Devuelve (anio, mes) desplazado n meses, sin bucles ni ramas por cambio de año."""
+    anios, mes0 = divmod(mes - 1 + n, 12)
+    return anio + anios, mes0 + 1
+
+def calcular_proximo_pago(hoy, dia_corte):
+    """Próxima fecha de corte a partir de hoy: este mes si el día aún no pasó, si no el siguiente."""
+    dia = min(dia_corte, 28)
+    anio, mes = sumar_meses(hoy.year, hoy.month, 1) if hoy.day > dia else (hoy.year, hoy.month)
+    return datetime(anio, mes, dia)
+
+# ============== NUMEROS A LETRAS ==============
+_UNIDADES = ('', 'UN', 'DOS', 'TRES', 'CUATRO', 'CINCO', 'SEIS', 'SIETE', 'OCHO', 'NUEVE')
+_DECENAS = ('', 'DIEZ', 'VEINTE', 'TREINTA', 'CUARENTA', 'CINCUENTA',
+            'SESENTA', 'SETENTA', 'OCHENTA', 'NOVENTA')
+_ESPECIALES = {
+    11: 'ONCE', 12: 'DOCE', 13: 'TRECE', 14: 'CATORCE', 15: 'QUINCE',
+    16: 'DIECISEIS', 17: 'DIECISIETE', 18: 'DIECIOCHO', 19: 'DIECINUEVE',
+    21: 'VEINTIUNO', 22: 'VEINTIDOS', 23: 'VEINTITRES', 24: 'VEINTICUATRO',
+    25: 'VEINTICINCO', 26: 'VEINTISEIS', 27: 'VEINTISIETE', 28: 'VEINTIOCHO', 29: 'VEINTINUEVE'
+}
+_CENTENAS = ('', 'CIENTO', 'DOSCIENTOS', 'TRESCIENTOS', 'CUATROCIENTOS',
+             'QUINIENTOS', 'SEISCIENTOS', 'SETECIENTOS', 'OCHOCIENTOS', 'NOVECIENTOS')
+
+
+def _entero_a_letras(num):
+    """Convierte la parte entera de un monto a letras en español (sin el sufijo de moneda)"""
+    if num == 0:
+        return 'CERO'
+    if num == 100:
+        return 'CIEN'
+    if num < 10:
+        return _UNIDADES[num]
+    if num < 30:
+        return _ESPECIALES.get(num, _DECENAS[num // 10])
+    if num < 100:
+        if num % 10 == 0:
+            return _DECENAS[num // 10]
+        return f"{_DECENAS[num // 10]} Y {_UNIDADES[num % 10]}"
+    if num < 1000:
+        if num % 100 == 0:
+            return _CENTENAS[num // 100]
+        resto = num % 100
+        if resto < 30 and resto in _ESPECIALES:
+            return f"{_CENTENAS[num // 100]} {_ESPECIALES[resto]}"
+        elif resto < 10:
+            return f"{_CENTENAS[num // 100]} {_UNIDADES[resto]}"
+        elif resto % 10 == 0:
+            return f"{_CENTENAS[num // 100]} {_DECENAS[resto // 10]}"
+        return f"{_CENTENAS[num // 100]} {_DECENAS[resto // 10]} Y {_UNIDADES[resto % 10]}"
+    miles = num // 1000
+    resto = num % 1000
+    letras = 'MIL' if miles == 1 else f"{_UNIDADES[miles]} MIL"
+    if resto > 0:
+        letras += ' ' + _LETRAS_0_999[resto]
+    return letras.strip()
+
+
+# Los montos de los recibos casi siempre caen en 0-999: se precalculan una sola vez
+_LETRAS_0_999 = tuple(_entero_a_letras(n) for n in range(1000))
+# Tabla completa 0-9999 (los miles se apoyan en la tabla anterior)
+_LETRAS_0_9999 = _LETRAS_0_999 + tuple(_entero_a_letras(n) for n in range(1000, 10000))
+
+
+@functools.lru_cache(maxsize=4096)
+def _centavos_a_letras(centavos):
+    num, decimal = divmod(centavos, 100)
+    letras = _LETRAS_0_9999[num] if 0 <= num < 10000 else _entero_a_letras(num)
+    if decimal == 0:
+        return f"{letras} QUETZALES EXACTOS"
+    return f"{letras} QUETZALES CON {decimal}/100"
+
+
+def numero_a_letras(numero):
+    """Convierte un monto a letras en español (ej. 'CIEN QUETZALES EXACTOS')"""
+    return _centavos_a_letras(int(round(numero * 100)))
+
+# ============== NOMBRES DE MESES ==============
+MESES_NOMBRES = ('', 'Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+                 'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre')
+MESES_CORTOS = ('', 'Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul',
+                'Ago', 'Sep', 'Oct', 'Nov', 'Dic')
+
+
+def separar_mes(mes):
+    """Convierte 'YYYY-MM' en (anio, nombre del mes); si no tiene ese formato devuelve (mes[:4], mes)"""
+    try:
+        anio, mes_num = mes.split('-')
+    except ValueError:
+        return mes[:4], mes
+    if mes_num.isdigit() and 1 <= int(mes_num) <= 12:
+        return anio, MESES_NOMBRES[int(mes_num)]
+    return anio, mes_num
+
 # ============== CONTEXT PROCESSOR ==============
 @app.context_processor
 def utility_processor():
@@ -83,7 +267,8 @@ login_manager.login_message_category = 'warning'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return Usuario.query.get(int(user_id))
+    # session.get usa el identity map: lecturas posteriores del mismo usuario en la petición no van a la BD
+    return db.session.get(Usuario, int(user_id))
 
 
 @login_manager.request_loader
@@ -93,7 +278,7 @@ def load_user_from_request(request):
         token = auth_header.split(' ', 1)[1]
         api_token = ApiToken.query.filter_by(token=token).first()
         if api_token:
-            user = Usuario.query.get(api_token.user_id)
+            user = db.session.get(Usuario, api_token.user_id)
             if user:
                 return user
     return None
@@ -165,9 +350,27 @@ class ApiToken(db.Model):
     
     usuario = db.relationship('Usuario', backref='api_tokens', lazy=True)
 
+# Columnas que devuelve /api/clientes (mismas claves que Cliente.to_dict)
+CLIENTE_API_COLS = (
+    'id', 'nombre', 'ip_address', 'plan', 'velocidad_download', 'velocidad_upload',
+    'telefono', 'email', 'direccion', 'cedula', 'estado', 'queue_name', 'mikrotik_id',
+    'router_id', 'dia_corte', 'fecha_ultimo_pago', 'fecha_proximo_pago', 'precio_mensual',
+    'saldo_pendiente', 'latitud', 'longitud', 'fecha_registro'
+)
+# attrgetter lee todos los atributos en una sola llamada (en C) dentro de to_dict()
+_cliente_valores = operator.attrgetter(*CLIENTE_API_COLS)
+
 class Cliente(db.Model):
     """Modelo de Cliente con campos adicionales para pagos y corte"""
     __tablename__ = 'clientes'
+    __table_args__ = (
+        db.Index('ix_cliente_estado_proxpago', 'estado', 'fecha_proximo_pago'),
+        db.Index('ix_cliente_estado_diacorte', 'estado', 'dia_corte'),
+        db.Index('ix_cliente_fecha_registro', 'fecha_registro'),
+        db.Index('ix_cliente_geo', 'latitud', 'longitud',
+                 sqlite_where=db.text('latitud IS NOT NULL'),
+                 postgresql_where=db.text('latitud IS NOT NULL')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
@@ -182,8 +385,8 @@ class Cliente(db.Model):
     
     # Estado y MikroTik
     estado = db.Column(db.String(20), default='activo')  # activo, suspendido, cortado
-    queue_name = db.Column(db.String(100))
-    mikrotik_id = db.Column(db.String(50))
+    queue_name = db.Column(db.String(100), index=True)
+    mikrotik_id = db.Column(db.String(50), index=True)
     router_id = db.Column(db.Integer, db.ForeignKey('config_mikrotik.id'), nullable=True)
     
     # Fechas de pago
@@ -205,35 +408,25 @@ class Cliente(db.Model):
     pagos = db.relationship('Pago', backref='cliente', lazy=True, cascade='all, delete-orphan')
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'nombre': self.nombre,
-            'ip_address': self.ip_address,
-            'plan': self.plan,
-            'velocidad_download': self.velocidad_download,
-            'velocidad_upload': self.velocidad_upload,
-            'telefono': self.telefono,
-            'email': self.email,
-            'direccion': self.direccion,
-            'cedula': self.cedula,
-            'estado': self.estado,
-            'queue_name': self.queue_name,
-            'mikrotik_id': self.mikrotik_id,
-            'router_id': self.router_id,
-            'dia_corte': self.dia_corte,
-            'fecha_ultimo_pago': self.fecha_ultimo_pago.strftime('%Y-%m-%d') if self.fecha_ultimo_pago else None,
-            'fecha_proximo_pago': self.fecha_proximo_pago.strftime('%Y-%m-%d') if self.fecha_proximo_pago else None,
-            'precio_mensual': self.precio_mensual,
-            'saldo_pendiente': self.saldo_pendiente,
-            'latitud': self.latitud,
-            'longitud': self.longitud,
-            'fecha_registro': self.fecha_registro.strftime('%Y-%m-%d %H:%M') if self.fecha_registro else None
-        }
+        data = dict(zip(CLIENTE_API_COLS, _cliente_valores(self)))
+        data['fecha_ultimo_pago'] = _fmt_d(data['fecha_ultimo_pago'])
+        data['fecha_proximo_pago'] = _fmt_d(data['fecha_proximo_pago'])
+        data['fecha_registro'] = _fmt_dt(data['fecha_registro'])
+        return data
+
 
+_PAGO_CAMPOS = ('id', 'cliente_id', 'monto', 'fecha_pago', 'mes_correspondiente',
+                'metodo_pago', 'referencia', 'notas')
+_pago_valores = operator.attrgetter(*_PAGO_CAMPOS)
 
 class Pago(db.Model):
     """Modelo de Pagos"""
     __tablename__ = 'pagos'
+    __table_args__ = (
+        db.Index('ix_pago_fecha', 'fecha_pago'),
+        db.Index('ix_pago_mes', 'mes_correspondiente'),
+        db.Index('ix_pago_cliente_fecha', 'cliente_id', 'fecha_pago'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False)
@@ -246,17 +439,10 @@ class Pago(db.Model):
     registrado_por = db.Column(db.String(50))
     
     def to_dict(self):
-        return {
-            'id': self.id,
-            'cliente_id': self.cliente_id,
-            'cliente_nombre': self.cliente.nombre if self.cliente else None,
-            'monto': self.monto,
-            'fecha_pago': self.fecha_pago.strftime('%Y-%m-%d %H:%M') if self.fecha_pago else None,
-            'mes_correspondiente': self.mes_correspondiente,
-            'metodo_pago': self.metodo_pago,
-            'referencia': self.referencia,
-            'notas': self.notas
-        }
+        data = dict(zip(_PAGO_CAMPOS, _pago_valores(self)))
+        data['cliente_nombre'] = self.cliente.nombre if self.cliente else None
+        data['fecha_pago'] = _fmt_dt(data['fecha_pago'])
+        return data
 
 
 class ConfigMikroTik(db.Model):
@@ -344,6 +530,50 @@ class Plan(db.Model):
     descripcion = db.Column(db.String(200))
 
 
+# Caché en memoria de la lista de planes (cambian muy poco)
+_planes_cache = {'data': None, 'ts': 0}
+PLANES_TTL = 120  # Segundos
+
+
+def get_planes_cached():
+    """Lista de planes como diccionarios, refrescada cada PLANES_TTL segundos"""
+    if _planes_cache['data'] is None or time.monotonic() - _planes_cache['ts'] > PLANES_TTL:
+        _planes_cache['data'] = [{
+            'id': p.id,
+            'nombre': p.nombre,
+            'velocidad_download': p.velocidad_download,
+            'velocidad_upload': p.velocidad_upload,
+            'precio': p.precio,
+            'descripcion': p.descripcion
+        } for p in Plan.query.all()]
+        _planes_cache['ts'] = time.monotonic()
+    return _planes_cache['data']
+
+
+def invalidate_planes_cache():
+    """Fuerza a recargar la lista de planes en la próxima consulta"""
+    _planes_cache['data'] = None
+
+
+# Caché corta de agregados del dashboard y reportes (se recalculan como máximo cada DASHBOARD_TTL)
+_dashboard_cache = {}
+DASHBOARD_TTL = 30  # Segundos
+
+
+def cache_dashboard(clave, calcular):
+    """Devuelve calcular() reutilizando el resultado anterior mientras no venza el TTL"""
+    entrada = _dashboard_cache.get(clave)
+    if entrada is None or time.monotonic() - entrada[0] > DASHBOARD_TTL:
+        entrada = (time.monotonic(), calcular())
+        _dashboard_cache[clave] = entrada
+    return entrada[1]
+
+
+def invalidate_dashboard_cache():
+    """Descarta los agregados en caché (tras crear/editar clientes o pagos)"""
+    _dashboard_cache.clear()
+
+
 class ConfigUISP(db.Model):
     """Configuración de la API de UISP (Ubiquiti)"""
     __tablename__ = 'config_uisp'
@@ -402,7 +632,7 @@ class Infraestructura(db.Model):
             'ubicacion': self.ubicacion,
             'modelo': self.modelo,
             'notas': self.notas,
-            'fecha_registro': self.fecha_registro.strftime('%Y-%m-%d %H:%M') if self.fecha_registro else None,
+            'fecha_registro': _fmt_dt(self.fecha_registro),
             'uisp_id': self.uisp_id,
             'mac': self.mac,
             'estado_online': self.estado_online,
@@ -419,7 +649,7 @@ class Infraestructura(db.Model):
             'gps': self.gps,
             'firmware': self.firmware,
             'clientes_conectados': self.clientes_conectados,
-            'ultima_sincronizacion': self.ultima_sincronizacion.strftime('%Y-%m-%d %H:%M:%S') if self.ultima_sincronizacion else None
+            'ultima_sincronizacion': _fmt_dts(self.ultima_sincronizacion)
         }
 
 
@@ -494,7 +724,7 @@ class Voucher(db.Model):
             'plan_nombre': self.plan.nombre if self.plan else None,
             'router_nombre': self.router.nombre if self.router else None,
             'vendedor_nombre': self.vendedor.nombre if self.vendedor else None,
-            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M') if self.fecha_creacion else None,
+            'fecha_creacion': _fmt_dt(self.fecha_creacion),
             'estado': self.estado,
             'perfil': self.plan.nombre_mikrotik if self.plan else 'default'
         }
@@ -535,13 +765,16 @@ class TransaccionVendedor(db.Model):
             'tipo': self.tipo,
             'monto': self.monto,
             'descripcion': self.descripcion,
-            'fecha': self.fecha.strftime('%Y-%m-%d %H:%M') if self.fecha else None
+            'fecha': _fmt_dt(self.fecha)
         }
 
 
 class AuditLog(db.Model):
     """Registro de actividad del sistema"""
     __tablename__ = 'audit_log'
+    __table_args__ = (
+        db.Index('ix_audit_fecha', 'fecha'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     usuario = db.Column(db.String(50), nullable=False)
@@ -561,7 +794,7 @@ class AuditLog(db.Model):
             'entidad_id': self.entidad_id,
             'detalle': self.detalle,
             'ip_origen': self.ip_origen,
-            'fecha': self.fecha.strftime('%Y-%m-%d %H:%M:%S') if self.fecha else None
+            'fecha': _fmt_dts(self.fecha)
         }
 
 
@@ -601,22 +834,44 @@ class AlertaOmada(db.Model):
 
 
 def registrar_auditoria(accion, entidad=None, entidad_id=None, detalle=None):
-    """Helper para registrar eventos de auditoría"""
+    """Helper para registrar eventos de auditoría.
+    Dentro de una petición los eventos se acumulan y se guardan en un solo commit al finalizarla."""
     try:
         usuario = current_user.username if current_user.is_authenticated else 'sistema'
-        ip = request.remote_addr if request else None
-        log = AuditLog(
-            usuario=usuario,
-            accion=accion,
-            entidad=entidad,
-            entidad_id=entidad_id,
-            detalle=detalle,
-            ip_origen=ip
-        )
-        db.session.add(log)
+        ip = request.remote_addr if has_request_context() else None
+        entrada = {
+            'usuario': usuario,
+            'accion': accion,
+            'entidad': entidad,
+            'entidad_id': entidad_id,
+            'detalle': detalle,
+            'ip_origen': ip,
+            'fecha': datetime.utcnow()
+        }
+        if has_request_context():
+            g.setdefault('audit_buffer', []).append(entrada)
+        else:
+            db.session.add(AuditLog(**entrada))
+            db.session.commit()
+    except Exception:
+        app.logger.exception("[AUDIT] Error registrando evento")
+
+
+@app.teardown_request
+def guardar_auditoria_pendiente(exc=None):
+    """Inserta en bloque los eventos de auditoría acumulados durante la petición"""
+    buffer = g.pop('audit_buffer', None)
+    if not buffer:
+        return
+    try:
+        from sqlalchemy import insert
+        if exc is not None:
+            db.session.rollback()
+        db.session.execute(insert(AuditLog), buffer)
         db.session.commit()
-    except Exception as e:
-        print(f"[AUDIT] Error: {e}")
+    except Exception:
+        db.session.rollback()
+        app.logger.exception("[AUDIT] Error guardando eventos")
 
 
 # ============== API MIKROTIK ==============
@@ -629,30 +884,49 @@ _mikrotik_status_cache = {
     'last_check': None
 }
 MIKROTIK_CACHE_TTL = 60  # Segundos antes de volver a consultar al router
+ADDRESS_LIST_INDEX_TTL = 30  # Segundos que se reutiliza el índice {address: .id} de un address list
+
+_mikrotik_status_lock = threading.Lock()
+# La consulta al router se hace fuera del lock: los demás hilos reciben el último estado
+# o esperan en esta condición si todavía no hay ninguno
+_mikrotik_status_cond = threading.Condition(_mikrotik_status_lock)
+_mikrotik_status_consultando = False
+_mikrotik_status_version = 0  # Cambia con invalidate_mikrotik_status(): descarta consultas en curso
+
+# Pool compartido para operaciones masivas contra los routers (máx. 8 llamadas simultáneas)
+_mt_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='mikrotik')
+
+# Tabla de traducción para limpiar acentos y caracteres especiales (se construye una sola vez)
+_MT_TRANSLATE = str.maketrans({
+    'á': 'a', 'à': 'a', 'ä': 'a', 'â': 'a', 'ã': 'a',
+    'é': 'e', 'è': 'e', 'ë': 'e', 'ê': 'e',
+    'í': 'i', 'ì': 'i', 'ï': 'i', 'î': 'i',
+    'ó': 'o', 'ò': 'o', 'ö': 'o', 'ô': 'o', 'õ': 'o',
+    'ú': 'u', 'ù': 'u', 'ü': 'u', 'û': 'u',
+    'ñ': 'n', 'ç': 'c',
+    'Á': 'A', 'À': 'A', 'Ä': 'A', 'Â': 'A', 'Ã': 'A',
+    'É': 'E', 'È': 'E', 'Ë': 'E', 'Ê': 'E',
+    'Í': 'I', 'Ì': 'I', 'Ï': 'I', 'Î': 'I',
+    'Ó': 'O', 'Ò': 'O', 'Ö': 'O', 'Ô': 'O', 'Õ': 'O',
+    'Ú': 'U', 'Ù': 'U', 'Ü': 'U', 'Û': 'U',
+    'Ñ': 'N', 'Ç': 'C'
+})
 
 def limpiar_texto_mikrotik(texto):
     """Limpia acentos y caracteres especiales para MikroTik"""
     if not texto:
         return texto
-    # Mapa de reemplazo de caracteres
-    reemplazos = {
-        'á': 'a', 'à': 'a', 'ä': 'a', 'â': 'a', 'ã': 'a',
-        'é': 'e', 'è': 'e', 'ë': 'e', 'ê': 'e',
-        'í': 'i', 'ì': 'i', 'ï': 'i', 'î': 'i',
-        'ó': 'o', 'ò': 'o', 'ö': 'o', 'ô': 'o', 'õ': 'o',
-        'ú': 'u', 'ù': 'u', 'ü': 'u', 'û': 'u',
-        'ñ': 'n', 'ç': 'c',
-        'Á': 'A', 'À': 'A', 'Ä': 'A', 'Â': 'A', 'Ã': 'A',
-        'É': 'E', 'È': 'E', 'Ë': 'E', 'Ê': 'E',
-        'Í': 'I', 'Ì': 'I', 'Ï': 'I', 'Î': 'I',
-        'Ó': 'O', 'Ò': 'O', 'Ö': 'O', 'Ô': 'O', 'Õ': 'O',
-        'Ú': 'U', 'Ù': 'U', 'Ü': 'U', 'Û': 'U',
-        'Ñ': 'N', 'Ç': 'C'
-    }
-    resultado = str(texto)
-    for original, reemplazo in reemplazos.items():
-        resultado = resultado.replace(original, reemplazo)
-    return resultado
+    return str(texto).translate(_MT_TRANSLATE)
+
+# Nombre del queue de un cliente: espacios del nombre y puntos de la IP pasan a '-'
+_QUEUE_NOMBRE_TRANSLATE = str.maketrans(' ', '-')
+_QUEUE_IP_TRANSLATE = str.maketrans('.', '-')
+
+def nombre_queue_cliente(nombre, ip):
+    """'cliente-<nombre>-<ip>' con el nombre en minúsculas y recortado a 30 caracteres"""
+    nombre = nombre if isinstance(nombre, str) else str(nombre)
+    ip = ip if isinstance(ip, str) else str(ip)
+    return f"cliente-{nombre.translate(_QUEUE_NOMBRE_TRANSLATE).lower()[:30]}-{ip.translate(_QUEUE_IP_TRANSLATE)}"
 
 class MikroTikAPI:
     """Clase para interactuar con MikroTik REST API"""
@@ -664,9 +938,31 @@ class MikroTikAPI:
         self.port = port
         self.protocol = 'https' if use_ssl else 'http'
         self.base_url = f"{self.protocol}://{self.host}:{self.port}/rest"
-        self.session = requests.Session()
+        self.session = self._configure_session(requests.Session(), self.base_url)
         self.session.auth = (username, password)
-        self.session.verify = False
+        self._address_index_cache = {}
+    
+    @classmethod
+    def _configure_session(cls, session, base_url):
+        """Configura TLS y el pool de conexiones de la sesión HTTP"""
+        session.verify = False
+        # Pool keep-alive: reutiliza la conexión TCP/TLS entre llamadas al router
+        session.mount(base_url, HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=20,
+            # Solo se reintentan 502/503/504 y un fallo de conexión: un router que no
+            # responde no multiplica el timeout (read=0)
+            max_retries=Retry(
+                total=2,
+                connect=1,
+                read=0,
+                status=2,
+                backoff_factor=0.3,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=frozenset(['GET', 'DELETE'])
+            )
+        ))
+        return session
     
     def test_connection(self):
         """Prueba la conexión al router"""
@@ -796,6 +1092,41 @@ class MikroTikAPI:
         except Exception as e:
             return False, str(e)
     
+    def create_many_simple_queues(self, queues):
+        """Crea varios Simple Queues en paralelo sobre la misma sesión HTTP.
+        queues es una lista de kwargs de create_simple_queue. Retorna [(success, id_o_error)] en el mismo orden"""
+        futures = [_mt_executor.submit(self.create_simple_queue, **kwargs) for kwargs in queues]
+        resultados = []
+        for future in futures:
+            try:
+                resultados.append(future.result())
+            except Exception as e:
+                resultados.append((False, str(e)))
+        return resultados
+    
+    def build_queue_target_index(self):
+        """Devuelve (success, {target: .id}) de todos los Simple Queues con una sola consulta"""
+        success, queues = self.get_simple_queues()
+        if not success or not isinstance(queues, list):
+            return False, {}
+        return True, {q.get('target', ''): q.get('.id', '') for q in queues if q.get('.id')}
+    
+    def update_many_simple_queues(self, updates):
+        """Actualiza varios Simple Queues en paralelo.
+        updates es una lista de (queue_id, kwargs). Retorna [(queue_id, success, mensaje)]"""
+        futures = [
+            (queue_id, _mt_executor.submit(self.update_simple_queue, queue_id, **kwargs))
+            for queue_id, kwargs in updates
+        ]
+        resultados = []
+        for queue_id, future in futures:
+            try:
+                success, result = future.result()
+            except Exception as e:
+                success, result = False, str(e)
+            resultados.append((queue_id, success, result))
+        return resultados
+    
     def suspend_queue(self, queue_id):
         """Suspende (deshabilita) un queue"""
         return self.update_simple_queue(queue_id, disabled=True)
@@ -823,36 +1154,131 @@ class MikroTikAPI:
             
             if response.status_code in [200, 201]:
                 result = response.json()
-                return True, result.get('.id', '')
+                entry_id = result.get('.id', '')
+                cached = self._address_index_cache.get(list_name)
+                if cached and entry_id:
+                    cached[1][ip_address] = entry_id
+                return True, entry_id
             else:
                 return False, f"Error {response.status_code}: {response.text}"
                 
         except Exception as e:
             return False, str(e)
     
+    def add_many_to_address_list(self, items, list_name="MOROSOS"):
+        """Agrega varias IPs al address list en paralelo.
+        items es una lista de (ip, comment). Retorna [(ip, success, id_o_error)]"""
+        futures = [
+            (ip, _mt_executor.submit(self.add_to_address_list, ip, list_name, comment))
+            for ip, comment in items
+        ]
+        resultados = []
+        for ip, future in futures:
+            try:
+                success, result = future.result()
+            except Exception as e:
+                success, result = False, str(e)
+            resultados.append((ip, success, result))
+        return resultados
+    
+    def build_address_index(self, list_name="MOROSOS"):
+        """Devuelve {address: .id} de un address list, reutilizando el índice por ADDRESS_LIST_INDEX_TTL segundos"""
+        cached = self._address_index_cache.get(list_name)
+        if cached and time.monotonic() - cached[0] < ADDRESS_LIST_INDEX_TTL:
+            return True, cached[1]
+        
+        success, entries = self.get_address_list(list_name)
+        if not success:
+            return False, entries
+        
+        index = {
+            entry.get('address'): entry.get('.id')
+            for entry in entries
+            if entry.get('list') == list_name and entry.get('.id')
+        }
+        self._address_index_cache[list_name] = (time.monotonic(), index)
+        return True, index
+    
+    def remove_many_from_address_list(self, ips, list_name="MOROSOS"):
+        """Remueve varias IPs del address list con una sola consulta del listado.
+        Retorna {ip: (success, mensaje)}"""
+        if len(ips) <= 1:
+            # Una sola IP: la consulta filtrada es más barata que bajar la lista completa
+            return {ip: self.remove_from_address_list(ip, list_name) for ip in ips}
+        
+        success, index = self.build_address_index(list_name)
+        if not success:
+            return {ip: (False, index) for ip in ips}
+        
+        resultados = {}
+        for ip in ips:
+            entry_id = index.get(ip)
+            if not entry_id:
+                # El índice puede estar desactualizado (IP agregada a mano o por otro proceso): confirmar con el router
+                resultados[ip] = self.remove_from_address_list(ip, list_name)
+                continue
+            try:
+                del_response = self.session.delete(
+                    f"{self.base_url}/ip/firewall/address-list/{entry_id}",
+                    timeout=15
+                )
+                if del_response.status_code in [200, 204]:
+                    index.pop(ip, None)
+                    resultados[ip] = (True, "OK")
+                elif del_response.status_code == 404:
+                    # El .id cacheado ya no existe, pero la IP pudo volver a agregarse con otro id
+                    resultados[ip] = self.remove_from_address_list(ip, list_name)
+                else:
+                    resultados[ip] = (False, f"Error {del_response.status_code}: {del_response.text}")
+            except Exception as e:
+                resultados[ip] = (False, str(e))
+        return resultados
+    
+    def _ids_en_address_list(self, ip_address, list_name):
+        """IDs de las entradas de una IP en el address list (consulta filtrada al router, sin índice)"""
+        response = self.session.get(
+            f"{self.base_url}/ip/firewall/address-list",
+            params={"list": list_name, "address": ip_address},
+            timeout=15
+        )
+        if response.status_code != 200:
+            return False, f"Error {response.status_code}"
+        return True, [
+            entry.get('.id') for entry in response.json()
+            if entry.get('address') == ip_address and entry.get('list') == list_name and entry.get('.id')
+        ]
+    
     def remove_from_address_list(self, ip_address, list_name="MOROSOS"):
         """Remueve una IP del address list"""
         try:
-            # Primero buscar el ID de la entrada
-            response = self.session.get(
-                f"{self.base_url}/ip/firewall/address-list",
-                params={"list": list_name, "address": ip_address},
-                timeout=15
-            )
+            success, ids = self._ids_en_address_list(ip_address, list_name)
+            if not success:
+                return False, ids
+            cached = self._address_index_cache.get(list_name)
+            if cached:
+                cached[1].pop(ip_address, None)
+            if not ids:
+                return True, "No encontrado (ya eliminado)"
             
-            if response.status_code == 200:
-                entries = response.json()
-                for entry in entries:
-                    if entry.get('address') == ip_address and entry.get('list') == list_name:
-                        entry_id = entry.get('.id')
-                        # Eliminar la entrada
-                        del_response = self.session.delete(
-                            f"{self.base_url}/ip/firewall/address-list/{entry_id}",
-                            timeout=15
-                        )
-                        return del_response.status_code in [200, 204], "OK"
+            hubo_404 = False
+            for entry_id in ids:
+                del_response = self.session.delete(
+                    f"{self.base_url}/ip/firewall/address-list/{entry_id}",
+                    timeout=15
+                )
+                if del_response.status_code == 404:
+                    hubo_404 = True
+                elif del_response.status_code not in [200, 204]:
+                    return False, f"Error {del_response.status_code}: {del_response.text}"
             
-            return True, "No encontrado (ya eliminado)"
+            if hubo_404:
+                # La entrada desapareció entre la consulta y el DELETE: verificar que la IP ya no esté
+                success, ids = self._ids_en_address_list(ip_address, list_name)
+                if not success:
+                    return False, ids
+                if ids:
+                    return False, "La IP sigue en el address list"
+            return True, "OK"
             
         except Exception as e:
             return False, str(e)
@@ -1191,21 +1617,138 @@ class MikroTikAPI:
         return data
 
 
+# Instancias de MikroTikAPI reutilizadas por router: {router_id: (config_hash, api)}
+_mt_api_cache = {}
+_mt_api_cache_lock = threading.Lock()
+
+
+def invalidate_mt_cache(router_id=None):
+    """Descarta las sesiones HTTP cacheadas (de un router o de todos)"""
+    with _mt_api_cache_lock:
+        if router_id is None:
+            cached = list(_mt_api_cache.values())
+            _mt_api_cache.clear()
+        else:
+            entry = _mt_api_cache.pop(router_id, None)
+            cached = [entry] if entry else []
+    if has_request_context():
+        g.pop('mikrotik_apis', None)
+    for _, api in cached:
+        try:
+            api.session.close()
+        except Exception:
+            pass
+
+
 def get_mikrotik_api(router_id=None):
-    """Obtiene instancia de la API de MikroTik con la configuración activa o por ID"""
+    """Obtiene instancia de la API de MikroTik con la configuración activa o por ID.
+    Dentro de una petición el resultado se reutiliza (sin volver a consultar ConfigMikroTik)."""
+    if not has_request_context():
+        return _crear_mikrotik_api(router_id)
+    apis = g.setdefault('mikrotik_apis', {})
+    if router_id not in apis:
+        apis[router_id] = _crear_mikrotik_api(router_id)
+    return apis[router_id]
+
+
+def _crear_mikrotik_api(router_id=None):
     if router_id:
         config = ConfigMikroTik.query.get(router_id)
     else:
         config = ConfigMikroTik.query.filter_by(activo=True).first()
     if not config:
         return None
-    return MikroTikAPI(
-        host=config.host,
-        username=config.username,
-        password=config.password,
-        port=config.port,
-        use_ssl=config.use_ssl
-    )
+    return api_para_router(config)
+
+
+def api_para_router(config):
+    """API para un ConfigMikroTik ya cargado, compartiendo instancia y pool de conexiones."""
+    # Reutilizar la instancia (y su pool de conexiones) mientras la configuración no cambie
+    config_hash = (config.host, config.port, config.username, config.password, config.use_ssl)
+    with _mt_api_cache_lock:
+        cached = _mt_api_cache.get(config.id)
+        if cached and cached[0] == config_hash:
+            return cached[1]
+        api = MikroTikAPI(
+            host=config.host,
+            username=config.username,
+            password=config.password,
+            port=config.port,
+            use_ssl=config.use_ssl
+        )
+        stale = cached[1] if cached else None
+        _mt_api_cache[config.id] = (config_hash, api)
+    if stale:
+        try:
+            stale.session.close()
+        except Exception:
+            pass
+    return api
+
+
+def _consultar_estado_mikrotik():
+    """Consulta al router activo: conexión y cantidad de queues"""
+    try:
+        api = get_mikrotik_api()
+        if not api:
+            return {'connected': False, 'message': 'Sin configurar', 'queue_count': 0}
+        # test_connection devuelve (success, message)
+        success, message = api.test_connection()
+        if not success:
+            return {'connected': False, 'message': message, 'queue_count': 0}
+        # Contar queues
+        queue_success, queues = api.get_simple_queues()
+        queue_count = len(queues) if queue_success and isinstance(queues, list) else 0
+        return {'connected': True, 'message': f'Conectado: {message}', 'queue_count': queue_count}
+    except Exception as e:
+        return {'connected': False, 'message': str(e)[:50], 'queue_count': 0}
+
+
+def get_mikrotik_status(force=False):
+    """Estado del MikroTik activo; consulta al router como máximo una vez cada MIKROTIK_CACHE_TTL segundos.
+    Solo un hilo consulta a la vez y lo hace sin el lock: el resto recibe el último estado
+    (o espera el primero)."""
+    global _mikrotik_status_cache, _mikrotik_status_consultando
+    with _mikrotik_status_cond:
+        while True:
+            last_check = _mikrotik_status_cache.get('last_check')
+            if not force and last_check is not None and time.monotonic() - last_check < MIKROTIK_CACHE_TTL:
+                return _mikrotik_status_cache
+            if not _mikrotik_status_consultando:
+                break
+            if not force and last_check is not None:
+                return _mikrotik_status_cache
+            _mikrotik_status_cond.wait()
+            force = False  # El resultado de la consulta que terminó ya es actual
+        _mikrotik_status_consultando = True
+        version = _mikrotik_status_version
+    
+    estado = None
+    try:
+        estado = _consultar_estado_mikrotik()
+        estado['last_check'] = time.monotonic()
+        # Cuerpo JSON de /api/mikrotik/status ya serializado: los hits de caché no vuelven a codificar
+        estado['body'] = app.json.dumps({
+            'success': True,
+            'connected': estado['connected'],
+            'message': estado['message'],
+            'queue_count': estado['queue_count']
+        })
+    finally:
+        with _mikrotik_status_cond:
+            _mikrotik_status_consultando = False
+            if estado is not None and version == _mikrotik_status_version:
+                _mikrotik_status_cache = estado
+            _mikrotik_status_cond.notify_all()
+    return estado
+
+
+def invalidate_mikrotik_status():
+    """Marca el estado cacheado como vencido; una consulta en curso ya no se guarda"""
+    global _mikrotik_status_cache, _mikrotik_status_version
+    with _mikrotik_status_lock:
+        _mikrotik_status_version += 1
+        _mikrotik_status_cache = {'connected': False, 'message': '', 'queue_count': 0, 'last_check': None}
 
 
 def get_address_list_name(router_id=None):
@@ -2087,22 +2630,30 @@ def index():
     """Página principal - Dashboard"""
     if current_user.rol == 'vendedor':
         return redirect(url_for('vendedor_dashboard'))
+    from sqlalchemy import func
     clientes = Cliente.query.order_by(Cliente.fecha_registro.desc()).limit(10).all()
-    total_clientes = Cliente.query.count()
-    clientes_activos = Cliente.query.filter_by(estado='activo').count()
-    clientes_suspendidos = Cliente.query.filter(Cliente.estado.in_(['suspendido', 'cortado'])).count()
-    planes = Plan.query.all()
+    
+    # Conteo por estado en una sola consulta
+    conteo_estados = dict(db.session.query(Cliente.estado, func.count(Cliente.id)).group_by(Cliente.estado).all())
+    total_clientes = sum(conteo_estados.values())
+    clientes_activos = conteo_estados.get('activo', 0)
+    clientes_suspendidos = conteo_estados.get('suspendido', 0) + conteo_estados.get('cortado', 0)
+    planes = get_planes_cached()
     
     # Estadísticas de pagos del mes actual (Ajustado a UTC-6 Guatemala)
     hoy = datetime.utcnow() - timedelta(hours=6)
     inicio_dia = hoy.replace(hour=0, minute=0, second=0, microsecond=0)
     primer_dia_mes = hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     
-    pagos_mes = Pago.query.filter(Pago.fecha_pago >= primer_dia_mes).all()
-    pagos_hoy = Pago.query.filter(Pago.fecha_pago >= inicio_dia).all()
-    
-    total_recaudado_mes = sum(p.monto for p in pagos_mes)
-    recaudado_hoy = sum(p.monto for p in pagos_hoy)
+    # Sumas calculadas en SQL (sin cargar filas de Pago)
+    total_recaudado_mes, recaudado_hoy = db.session.query(
+        func.coalesce(func.sum(Pago.monto), 0),
+        func.coalesce(func.sum(db.case((Pago.fecha_pago >= inicio_dia, Pago.monto), else_=0)), 0)
+    ).filter(Pago.fecha_pago >= primer_dia_mes).one()
+    ids_pagados_mes = {
+        cliente_id for (cliente_id,) in
+        db.session.query(Pago.cliente_id).filter(Pago.fecha_pago >= primer_dia_mes).distinct()
+    }
     
     # Calcular pendiente por cobrar (Total esperado de planes activos - Total recaudado)
     clientes_lista_activos = Cliente.query.filter_by(estado='activo').all()
@@ -2111,7 +2662,6 @@ def index():
     if pendiente_cobrar < 0: pendiente_cobrar = 0
     
     # Vencimientos próximos
-    from sqlalchemy import func
     manana = hoy + timedelta(days=1)
     
     # Debido a diferencias de horas, comparamos las fechas formateadas
@@ -2134,11 +2684,11 @@ def index():
                 monto_vencido += precio
             else:
                 # Si no está vencido, veamos si ya pagó este mes
-                if c.id not in {p.cliente_id for p in pagos_mes}:
+                if c.id not in ids_pagados_mes:
                     monto_pendiente += precio
                 
     # Clientes pagados vs pendientes
-    pagados_mes_count = len({p.cliente_id for p in pagos_mes})
+    pagados_mes_count = len(ids_pagados_mes)
     pendientes_count = clientes_activos - pagados_mes_count - vencidos_count
     if pendientes_count < 0: pendientes_count = 0
     
@@ -2189,8 +2739,15 @@ def index():
 @login_required
 def listar_clientes():
     """Lista todos los clientes"""
-    clientes = Cliente.query.order_by(Cliente.fecha_registro.desc()).all()
-    planes = Plan.query.all()
+    # Solo las columnas que usa la tabla de clientes (evita traer coordenadas, ids de MikroTik, etc.)
+    clientes = Cliente.query.options(load_only(
+        Cliente.id, Cliente.nombre, Cliente.ip_address, Cliente.plan,
+        Cliente.velocidad_download, Cliente.velocidad_upload, Cliente.telefono,
+        Cliente.email, Cliente.direccion, Cliente.cedula, Cliente.estado,
+        Cliente.router_id, Cliente.dia_corte, Cliente.fecha_ultimo_pago,
+        Cliente.fecha_proximo_pago, Cliente.precio_mensual, Cliente.saldo_pendiente
+    )).order_by(Cliente.fecha_registro.desc()).all()
+    planes = get_planes_cached()
     routers = ConfigMikroTik.query.all()
     mes_actual = (datetime.utcnow() - timedelta(hours=6)).strftime('%Y-%m')
     hoy = datetime.utcnow() - timedelta(hours=6)
@@ -2236,7 +2793,7 @@ def listar_clientes():
 @login_required
 def pagos_view():
     """Página de gestión de pagos"""
-    pagos = Pago.query.order_by(Pago.fecha_pago.desc()).limit(50).all()
+    pagos = Pago.query.options(selectinload(Pago.cliente)).order_by(Pago.fecha_pago.desc()).limit(50).all()
     clientes = Cliente.query.order_by(Cliente.nombre).all()
     return render_template('pagos.html', pagos=pagos, clientes=clientes)
 
@@ -2253,7 +2810,7 @@ def reportes_view():
 @login_required
 def ver_recibo(pago_id):
     """Ver recibo individual de un pago"""
-    pago = Pago.query.get_or_404(pago_id)
+    pago = Pago.query.options(joinedload(Pago.cliente)).filter_by(id=pago_id).first_or_404()
     cliente = pago.cliente
     return render_template('recibo.html', pago=pago, cliente=cliente)
 
@@ -2264,89 +2821,23 @@ def recibos_mes(mes=None):
     """Generar recibos múltiples de un mes específico"""
     from datetime import datetime
     
-    # Función para convertir número a letras en español
-    def numero_a_letras(numero):
-        unidades = ['', 'UN', 'DOS', 'TRES', 'CUATRO', 'CINCO', 'SEIS', 'SIETE', 'OCHO', 'NUEVE']
-        decenas = ['', 'DIEZ', 'VEINTE', 'TREINTA', 'CUARENTA', 'CINCUENTA', 
-                   'SESENTA', 'SETENTA', 'OCHENTA', 'NOVENTA']
-        especiales = {
-            11: 'ONCE', 12: 'DOCE', 13: 'TRECE', 14: 'CATORCE', 15: 'QUINCE',
-            16: 'DIECISEIS', 17: 'DIECISIETE', 18: 'DIECIOCHO', 19: 'DIECINUEVE',
-            21: 'VEINTIUNO', 22: 'VEINTIDOS', 23: 'VEINTITRES', 24: 'VEINTICUATRO',
-            25: 'VEINTICINCO', 26: 'VEINTISEIS', 27: 'VEINTISIETE', 28: 'VEINTIOCHO', 29: 'VEINTINUEVE'
-        }
-        centenas = ['', 'CIENTO', 'DOSCIENTOS', 'TRESCIENTOS', 'CUATROCIENTOS', 
-                    'QUINIENTOS', 'SEISCIENTOS', 'SETECIENTOS', 'OCHOCIENTOS', 'NOVECIENTOS']
-        
-        num = int(numero)
-        decimal = int(round((numero - num) * 100))
-        
-        if num == 0:
-            letras = 'CERO'
-        elif num == 100:
-            letras = 'CIEN'
-        elif num < 10:
-            letras = unidades[num]
-        elif num < 30:
-            letras = especiales.get(num, decenas[num // 10])
-        elif num < 100:
-            if num % 10 == 0:
-                letras = decenas[num // 10]
-            else:
-                letras = f"{decenas[num // 10]} Y {unidades[num % 10]}"
-        elif num < 1000:
-            if num % 100 == 0:
-                letras = centenas[num // 100]
-            else:
-                resto = num % 100
-                if resto < 30 and resto in especiales:
-                    letras = f"{centenas[num // 100]} {especiales[resto]}"
-                elif resto < 10:
-                    letras = f"{centenas[num // 100]} {unidades[resto]}"
-                elif resto % 10 == 0:
-                    letras = f"{centenas[num // 100]} {decenas[resto // 10]}"
-                else:
-                    letras = f"{centenas[num // 100]} {decenas[resto // 10]} Y {unidades[resto % 10]}"
-        else:
-            miles = num // 1000
-            resto = num % 1000
-            if miles == 1:
-                letras = 'MIL'
-            else:
-                letras = f"{unidades[miles]} MIL"
-            if resto > 0:
-                letras += ' ' + numero_a_letras(resto).replace(' QUETZALES EXACTOS', '').replace(' QUETZALES CON', '')
-            letras = letras.strip()
-        
-        # Agregar la palabra QUETZALES
-        if decimal == 0:
-            return f"{letras} QUETZALES EXACTOS"
-        else:
-            return f"{letras} QUETZALES CON {decimal}/100"
-    
     # Si no se especifica mes, usar el mes actual
     if not mes:
         mes = datetime.now().strftime('%Y-%m')
     
     # Obtener pagos del mes
-    pagos = Pago.query.filter(Pago.mes_correspondiente == mes).order_by(Pago.fecha_pago.desc()).all()
-    
-    # Calcular total
+    # Solo las columnas que imprime el recibo (del pago y de su cliente)
+    pagos = Pago.query.options(
+        load_only(Pago.id, Pago.cliente_id, Pago.monto, Pago.fecha_pago, Pago.mes_correspondiente,
+                  Pago.metodo_pago, Pago.referencia),
+        selectinload(Pago.cliente).load_only(Cliente.id, Cliente.nombre, Cliente.ip_address,
+                                              Cliente.plan, Cliente.telefono, Cliente.direccion)
+    ).filter(Pago.mes_correspondiente == mes).order_by(Pago.fecha_pago.desc()).all()
+    
+    # Calcular total (las filas ya se necesitan para los recibos; no hace falta otra consulta)
     total = sum(p.monto for p in pagos)
     
-    # Nombres de meses en español
-    meses_nombres = {
-        '01': 'Enero', '02': 'Febrero', '03': 'Marzo', '04': 'Abril',
-        '05': 'Mayo', '06': 'Junio', '07': 'Julio', '08': 'Agosto',
-        '09': 'Septiembre', '10': 'Octubre', '11': 'Noviembre', '12': 'Diciembre'
-    }
-    
-    try:
-        anio, mes_num = mes.split('-')
-        mes_nombre = meses_nombres.get(mes_num, mes_num)
-    except:
-        anio = mes[:4]
-        mes_nombre = mes
+    anio, mes_nombre = separar_mes(mes)
     
     return render_template('recibos_multiple.html', 
                          pagos=pagos, 
@@ -2362,72 +2853,14 @@ def recibos_mes(mes=None):
 def avisos_cobro(mes=None):
     """Generar avisos de cobro (recibos antes de pagar) para todos los clientes activos"""
     from datetime import datetime
+    ahora = datetime.now()
 
     filtro = request.args.get('filtro', 'todos')  # 'todos' o 'morosos'
     estado_pago = request.args.get('estado_pago', 'pendiente')  # 'pendiente' o 'pagado'
 
-    # Función para convertir número a letras en español
-    def numero_a_letras(numero):
-        unidades = ['', 'UN', 'DOS', 'TRES', 'CUATRO', 'CINCO', 'SEIS', 'SIETE', 'OCHO', 'NUEVE']
-        decenas = ['', 'DIEZ', 'VEINTE', 'TREINTA', 'CUARENTA', 'CINCUENTA', 
-                   'SESENTA', 'SETENTA', 'OCHENTA', 'NOVENTA']
-        especiales = {
-            11: 'ONCE', 12: 'DOCE', 13: 'TRECE', 14: 'CATORCE', 15: 'QUINCE',
-            16: 'DIECISEIS', 17: 'DIECISIETE', 18: 'DIECIOCHO', 19: 'DIECINUEVE',
-            21: 'VEINTIUNO', 22: 'VEINTIDOS', 23: 'VEINTITRES', 24: 'VEINTICUATRO',
-            25: 'VEINTICINCO', 26: 'VEINTISEIS', 27: 'VEINTISIETE', 28: 'VEINTIOCHO', 29: 'VEINTINUEVE'
-        }
-        centenas = ['', 'CIENTO', 'DOSCIENTOS', 'TRESCIENTOS', 'CUATROCIENTOS', 
-                    'QUINIENTOS', 'SEISCIENTOS', 'SETECIENTOS', 'OCHOCIENTOS', 'NOVECIENTOS']
-        
-        num = int(numero)
-        decimal = int(round((numero - num) * 100))
-        
-        if num == 0:
-            letras = 'CERO'
-        elif num == 100:
-            letras = 'CIEN'
-        elif num < 10:
-            letras = unidades[num]
-        elif num < 30:
-            letras = especiales.get(num, decenas[num // 10])
-        elif num < 100:
-            if num % 10 == 0:
-                letras = decenas[num // 10]
-            else:
-                letras = f"{decenas[num // 10]} Y {unidades[num % 10]}"
-        elif num < 1000:
-            if num % 100 == 0:
-                letras = centenas[num // 100]
-            else:
-                resto = num % 100
-                if resto < 30 and resto in especiales:
-                    letras = f"{centenas[num // 100]} {especiales[resto]}"
-                elif resto < 10:
-                    letras = f"{centenas[num // 100]} {unidades[resto]}"
-                elif resto % 10 == 0:
-                    letras = f"{centenas[num // 100]} {decenas[resto // 10]}"
-                else:
-                    letras = f"{centenas[num // 100]} {decenas[resto // 10]} Y {unidades[resto % 10]}"
-        else:
-            miles = num // 1000
-            resto = num % 1000
-            if miles == 1:
-                letras = 'MIL'
-            else:
-                letras = f"{unidades[miles]} MIL"
-            if resto > 0:
-                letras += ' ' + numero_a_letras(resto).replace(' QUETZALES EXACTOS', '').replace(' QUETZALES CON', '')
-            letras = letras.strip()
-        
-        if decimal == 0:
-            return f"{letras} QUETZALES EXACTOS"
-        else:
-            return f"{letras} QUETZALES CON {decimal}/100"
-    
     # Si no se especifica mes, usar el mes actual
     if not mes:
-        mes = datetime.now().strftime('%Y-%m')
+        mes = ahora.strftime('%Y-%m')
 
     # Obtener clientes activos
     router_id = request.args.get('router_id', type=int)
@@ -2451,19 +2884,7 @@ def avisos_cobro(mes=None):
     # Calcular total
     total = sum(c.precio_mensual for c in clientes if c.precio_mensual)
 
-    # Nombres de meses en español
-    meses_nombres = {
-        '01': 'Enero', '02': 'Febrero', '03': 'Marzo', '04': 'Abril',
-        '05': 'Mayo', '06': 'Junio', '07': 'Julio', '08': 'Agosto',
-        '09': 'Septiembre', '10': 'Octubre', '11': 'Noviembre', '12': 'Diciembre'
-    }
-    
-    try:
-        anio, mes_num = mes.split('-')
-        mes_nombre = meses_nombres.get(mes_num, mes_num)
-    except:
-        anio = mes[:4]
-        mes_nombre = mes
+    anio, mes_nombre = separar_mes(mes)
         
     def calcular_vencimiento(mes_str, dia_corte):
         try:
@@ -2486,7 +2907,7 @@ def avisos_cobro(mes=None):
                          filtro=filtro,
                          estado_pago=estado_pago,
                          total_activos=len(clientes_activos),
-                         fecha_emision=datetime.now().strftime('%d-%m-%Y'),
+                         fecha_emision=ahora.strftime('%d-%m-%Y'),
                          numero_a_letras=numero_a_letras,
                          calcular_vencimiento=calcular_vencimiento)
 
@@ -2496,84 +2917,16 @@ def avisos_cobro(mes=None):
 def aviso_cobro_individual(cliente_id, mes=None):
     """Generar aviso de cobro individual para un cliente"""
     from datetime import datetime
+    ahora = datetime.now()
 
     estado_pago = request.args.get('estado_pago', 'pendiente')  # 'pendiente' o 'pagado'
 
-    def numero_a_letras(numero):
-        unidades = ['', 'UN', 'DOS', 'TRES', 'CUATRO', 'CINCO', 'SEIS', 'SIETE', 'OCHO', 'NUEVE']
-        decenas = ['', 'DIEZ', 'VEINTE', 'TREINTA', 'CUARENTA', 'CINCUENTA', 
-                   'SESENTA', 'SETENTA', 'OCHENTA', 'NOVENTA']
-        especiales = {
-            11: 'ONCE', 12: 'DOCE', 13: 'TRECE', 14: 'CATORCE', 15: 'QUINCE',
-            16: 'DIECISEIS', 17: 'DIECISIETE', 18: 'DIECIOCHO', 19: 'DIECINUEVE',
-            21: 'VEINTIUNO', 22: 'VEINTIDOS', 23: 'VEINTITRES', 24: 'VEINTICUATRO',
-            25: 'VEINTICINCO', 26: 'VEINTISEIS', 27: 'VEINTISIETE', 28: 'VEINTIOCHO', 29: 'VEINTINUEVE'
-        }
-        centenas = ['', 'CIENTO', 'DOSCIENTOS', 'TRESCIENTOS', 'CUATROCIENTOS', 
-                    'QUINIENTOS', 'SEISCIENTOS', 'SETECIENTOS', 'OCHOCIENTOS', 'NOVECIENTOS']
-        
-        num = int(numero)
-        decimal = int(round((numero - num) * 100))
-        
-        if num == 0:
-            letras = 'CERO'
-        elif num == 100:
-            letras = 'CIEN'
-        elif num < 10:
-            letras = unidades[num]
-        elif num < 30:
-            letras = especiales.get(num, decenas[num // 10])
-        elif num < 100:
-            if num % 10 == 0:
-                letras = decenas[num // 10]
-            else:
-                letras = f"{decenas[num // 10]} Y {unidades[num % 10]}"
-        elif num < 1000:
-            if num % 100 == 0:
-                letras = centenas[num // 100]
-            else:
-                resto = num % 100
-                if resto < 30 and resto in especiales:
-                    letras = f"{centenas[num // 100]} {especiales[resto]}"
-                elif resto < 10:
-                    letras = f"{centenas[num // 100]} {unidades[resto]}"
-                elif resto % 10 == 0:
-                    letras = f"{centenas[num // 100]} {decenas[resto // 10]}"
-                else:
-                    letras = f"{centenas[num // 100]} {decenas[resto // 10]} Y {unidades[resto % 10]}"
-        else:
-            miles = num // 1000
-            resto = num % 1000
-            if miles == 1:
-                letras = 'MIL'
-            else:
-                letras = f"{unidades[miles]} MIL"
-            if resto > 0:
-                letras += ' ' + numero_a_letras(resto).replace(' QUETZALES EXACTOS', '').replace(' QUETZALES CON', '')
-            letras = letras.strip()
-        
-        if decimal == 0:
-            return f"{letras} QUETZALES EXACTOS"
-        else:
-            return f"{letras} QUETZALES CON {decimal}/100"
-    
     if not mes:
-        mes = datetime.now().strftime('%Y-%m')
+        mes = ahora.strftime('%Y-%m')
     
     cliente = Cliente.query.get_or_404(cliente_id)
     
-    meses_nombres = {
-        '01': 'Enero', '02': 'Febrero', '03': 'Marzo', '04': 'Abril',
-        '05': 'Mayo', '06': 'Junio', '07': 'Julio', '08': 'Agosto',
-        '09': 'Septiembre', '10': 'Octubre', '11': 'Noviembre', '12': 'Diciembre'
-    }
-    
-    try:
-        anio, mes_num = mes.split('-')
-        mes_nombre = meses_nombres.get(mes_num, mes_num)
-    except:
-        anio = mes[:4]
-        mes_nombre = mes
+    anio, mes_nombre = separar_mes(mes)
         
     def calcular_vencimiento(mes_str, dia_corte):
         try:
@@ -2596,7 +2949,7 @@ def aviso_cobro_individual(cliente_id, mes=None):
                          filtro='individual',
                          estado_pago=estado_pago,
                          total_activos=1,
-                         fecha_emision=datetime.now().strftime('%d-%m-%Y'),
+                         fecha_emision=ahora.strftime('%d-%m-%Y'),
                          numero_a_letras=numero_a_letras,
                          calcular_vencimiento=calcular_vencimiento)
 
@@ -2605,10 +2958,15 @@ def aviso_cobro_individual(cliente_id, mes=None):
 @login_required
 def obtener_meses_con_pagos():
     """Obtener lista de meses que tienen pagos registrados"""
-    from sqlalchemy import distinct
+    from sqlalchemy import select
     
-    meses = db.session.query(distinct(Pago.mes_correspondiente)).order_by(Pago.mes_correspondiente.desc()).all()
-    meses_list = [m[0] for m in meses if m[0]]
+    # DISTINCT + ORDER BY resueltos en la BD sobre ix_pago_mes; vacíos filtrados en SQL
+    meses_list = db.session.execute(
+        select(Pago.mes_correspondiente)
+        .where(Pago.mes_correspondiente.isnot(None), Pago.mes_correspondiente != '')
+        .distinct()
+        .order_by(Pago.mes_correspondiente.desc())
+    ).scalars().all()
     
     return jsonify({
         'success': True,
@@ -2778,22 +3136,21 @@ def ai_chat():
     # Inyectar contexto de la base de datos al bot
     try:
         from datetime import datetime
+        from sqlalchemy import func
         hoy = datetime.now().date()
-        clientes = Cliente.query.all()
-        total_clientes = len(clientes)
-        
-        morosos = []
-        activos = 0
-        suspendidos = 0
-        for c in clientes:
-            if c.estado == 'activo':
-                activos += 1
-                if c.fecha_proximo_pago and c.fecha_proximo_pago.date() < hoy:
-                    dias = (hoy - c.fecha_proximo_pago.date()).days
-                    if dias > 0:
-                        morosos.append(f"{c.nombre} ({dias} días vencidos)")
-            elif c.estado == 'suspendido':
-                suspendidos += 1
+        
+        # Conteos por estado en SQL (GROUP BY) en vez de recorrer todos los clientes
+        por_estado = dict(db.session.query(Cliente.estado, func.count(Cliente.id)).group_by(Cliente.estado).all())
+        total_clientes = sum(por_estado.values())
+        activos = por_estado.get('activo', 0)
+        suspendidos = por_estado.get('suspendido', 0)
+        
+        # Solo los activos con el pago vencido antes de hoy
+        vencidos = db.session.query(Cliente.nombre, Cliente.fecha_proximo_pago).filter(
+            Cliente.estado == 'activo',
+            Cliente.fecha_proximo_pago < datetime(hoy.year, hoy.month, hoy.day)
+        ).order_by(Cliente.id)
+        morosos = [f"{nombre} ({(hoy - fecha.date()).days} días vencidos)" for nombre, fecha in vencidos]
                     
         lista_morosos = ", ".join(morosos)
         
@@ -2965,78 +3322,7 @@ def clientes_live_status():
 @login_required
 def mikrotik_status():
     """Verificar estado de conexión a MikroTik (con caché)"""
-    global _mikrotik_status_cache
-    from datetime import datetime, timedelta
-    
-    # Si hay caché válido, devolver sin consultar al router
-    last_check = _mikrotik_status_cache.get('last_check')
-    if last_check and (datetime.now() - last_check).total_seconds() < MIKROTIK_CACHE_TTL:
-        return jsonify({
-            'success': True,
-            'connected': _mikrotik_status_cache['connected'],
-            'message': _mikrotik_status_cache['message'],
-            'queue_count': _mikrotik_status_cache['queue_count']
-        })
-    
-    try:
-        api = get_mikrotik_api()
-        if not api:
-            _mikrotik_status_cache = {
-                'connected': False,
-                'message': 'Sin configurar',
-                'queue_count': 0,
-                'last_check': datetime.now()
-            }
-            return jsonify({
-                'success': True,
-                'connected': False,
-                'message': 'Sin configurar'
-            })
-        
-        # test_connection devuelve (success, message)
-        success, message = api.test_connection()
-        if success:
-            # Contar queues
-            queue_success, queues = api.get_simple_queues()
-            queue_count = len(queues) if queue_success and isinstance(queues, list) else 0
-            
-            _mikrotik_status_cache = {
-                'connected': True,
-                'message': f'Conectado: {message}',
-                'queue_count': queue_count,
-                'last_check': datetime.now()
-            }
-            
-            return jsonify({
-                'success': True,
-                'connected': True,
-                'message': f'Conectado: {message}',
-                'queue_count': queue_count
-            })
-        else:
-            _mikrotik_status_cache = {
-                'connected': False,
-                'message': message,
-                'queue_count': 0,
-                'last_check': datetime.now()
-            }
-            return jsonify({
-                'success': True,
-                'connected': False,
-                'message': message
-            })
-    except Exception as e:
-        _mikrotik_status_cache = {
-            'connected': False,
-            'message': str(e)[:50],
-            'queue_count': 0,
-            'last_check': datetime.now()
-        }
-        return jsonify({
-            'success': True,
-            'connected': False,
-            'message': str(e)[:50]
-        })
+    return Response(get_mikrotik_status()['body'], mimetype='application/json')
 
 
 # ============== API CLIENTES ==============
@@ -3055,8 +3341,8 @@ def crear_cliente():
             return jsonify({'success': False, 'error': 'La IP es requerida'}), 400
         
         # Verificar IP duplicada
-        existing = Cliente.query.filter_by(ip_address=data['ip_address']).first()
-        if existing:
+        existing_id = db.session.query(Cliente.id).filter_by(ip_address=data['ip_address']).scalar()
+        if existing_id is not None:
             return jsonify({'success': False, 'error': 'Esta IP ya está registrada'}), 400
         
         # Obtener velocidades y precio del plan
@@ -3072,8 +3358,7 @@ def crear_cliente():
                 precio = plan.precio
         
         # Generar nombre del queue
-        nombre_limpio = data['nombre'].replace(' ', '-').lower()[:30]
-        queue_name = f"cliente-{nombre_limpio}-{data['ip_address'].replace('.', '-')}"
+        queue_name = nombre_queue_cliente(data['nombre'], data['ip_address'])
         
         # Determinar el router_id
         router_id = data.get('router_id')
@@ -3127,16 +3412,8 @@ def crear_cliente():
         
         # Calcular fecha próximo pago
         hoy = datetime.now()
-        dia_corte = int(data.get('dia_corte', 1))
-        if dia_corte > 28:
-            dia_corte = 28
-        
-        proximo_mes = hoy.month + 1 if hoy.day > dia_corte else hoy.month
-        proximo_anio = hoy.year + 1 if proximo_mes > 12 else hoy.year
-        if proximo_mes > 12:
-            proximo_mes = 1
-        
-        fecha_proximo_pago = datetime(proximo_anio, proximo_mes, dia_corte)
+        dia_corte = min(int(data.get('dia_corte', 1)), 28)
+        fecha_proximo_pago = calcular_proximo_pago(hoy, dia_corte)
         
         # Crear cliente en base de datos
         cliente = Cliente(
@@ -3160,6 +3437,7 @@ def crear_cliente():
         
         db.session.add(cliente)
         db.session.commit()
+        invalidate_dashboard_cache()
         
         return jsonify({
             'success': True,
@@ -3243,8 +3521,8 @@ def actualizar_cliente(id):
         # Actualizar IP si cambió
         if data.get('ip_address') and data['ip_address'] != cliente.ip_address:
             # Verificar que no exista
-            existing = Cliente.query.filter_by(ip_address=data['ip_address']).first()
-            if existing and existing.id != id:
+            existing_id = db.session.query(Cliente.id).filter_by(ip_address=data['ip_address']).scalar()
+            if existing_id is not None and existing_id != id:
                 return jsonify({'success': False, 'error': 'Esta IP ya está en uso'}), 400
             
             cliente.ip_address = data['ip_address']
@@ -3277,8 +3555,7 @@ def actualizar_cliente(id):
                     new_api = get_mikrotik_api(new_router_id)
                     if new_api:
                         # Generar nombre limpio
-                        nombre_limpio = cliente.nombre.replace(' ', '-').lower()[:30]
-                        queue_name = f"cliente-{nombre_limpio}-{cliente.ip_address.replace('.', '-')}"
+                        queue_name = nombre_queue_cliente(cliente.nombre, cliente.ip_address)
                         cliente.queue_name = queue_name
 
                         success, result = new_api.create_simple_queue(
@@ -3299,6 +3576,7 @@ def actualizar_cliente(id):
                     router_warning = 'El cliente se movió de router, pero ocurrió un error al crear su queue en el MikroTik nuevo. Verifica el queue manualmente.'
 
         db.session.commit()
+        invalidate_dashboard_cache()
         response = {'success': True, 'cliente': cliente.to_dict()}
         if router_warning:
             response['warning'] = router_warning
@@ -3329,6 +3607,7 @@ def eliminar_cliente(id):
         nombre_cliente = cliente.nombre
         db.session.delete(cliente)
         db.session.commit()
+        invalidate_dashboard_cache()
         registrar_auditoria('eliminar', 'cliente', id, f'Cliente eliminado: {nombre_cliente}')
         
         return jsonify({'success': True, 'message': 'Cliente eliminado'})
@@ -3343,7 +3622,9 @@ def eliminar_cliente(id):
 def suspender_cliente(id):
     """Suspender cliente (deshabilitar queue)"""
     try:
-        cliente = Cliente.query.get_or_404(id)
+        cliente = _estado_cliente(id)
+        if not cliente:
+            return jsonify({'success': False, 'error': 'Cliente no encontrado'}), 404
         
         if cliente.mikrotik_id:
             api = get_mikrotik_api(cliente.router_id)
@@ -3352,8 +3633,9 @@ def suspender_cliente(id):
                 if not success:
                     return jsonify({'success': False, 'error': f'Error MikroTik: {msg}'}), 500
         
-        cliente.estado = 'suspendido'
+        _cambiar_estado_cliente(id, 'suspendido')
         db.session.commit()
+        invalidate_dashboard_cache()
         
         return jsonify({'success': True, 'message': 'Cliente suspendido'})
         
@@ -3367,7 +3649,9 @@ def suspender_cliente(id):
 def activar_cliente(id):
     """Activar cliente (habilitar queue y remover de address list)"""
     try:
-        cliente = Cliente.query.get_or_404(id)
+        cliente = _estado_cliente(id)
+        if not cliente:
+            return jsonify({'success': False, 'error': 'Cliente no encontrado'}), 404
         
         api = get_mikrotik_api(cliente.router_id)
         if api:
@@ -3381,8 +3665,9 @@ def activar_cliente(id):
             if cliente.estado == 'cortado':
                 api.remove_from_address_list(cliente.ip_address, get_address_list_name(cliente.router_id))
         
-        cliente.estado = 'activo'
+        _cambiar_estado_cliente(id, 'activo')
         db.session.commit()
+        invalidate_dashboard_cache()
         
         return jsonify({'success': True, 'message': 'Cliente activado'})
         
@@ -3396,7 +3681,9 @@ def activar_cliente(id):
 def cortar_cliente(id):
     """Cortar cliente por medio de Address List (bloqueo por firewall)"""
     try:
-        cliente = Cliente.query.get_or_404(id)
+        cliente = _estado_cliente(id)
+        if not cliente:
+            return jsonify({'success': False, 'error': 'Cliente no encontrado'}), 404
         
         api = get_mikrotik_api(cliente.router_id)
         if api:
@@ -3410,8 +3697,9 @@ def cortar_cliente(id):
             if not success:
                 return jsonify({'success': False, 'error': f'Error MikroTik: {result}'}), 500
         
-        cliente.estado = 'cortado'
+        _cambiar_estado_cliente(id, 'cortado')
         db.session.commit()
+        invalidate_dashboard_cache()
         
         return jsonify({'success': True, 'message': 'Cliente cortado (agregado a Address List)'})
         
@@ -3420,17 +3708,49 @@ def cortar_cliente(id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _estado_cliente(id):
+    """Fila con los datos que usan suspender/activar/cortar (sin cargar el objeto Cliente)"""
+    return db.session.execute(
+        db.select(Cliente.nombre, Cliente.ip_address, Cliente.estado, Cliente.mikrotik_id, Cliente.router_id)
+        .where(Cliente.id == id)
+    ).one_or_none()
+
+
+def _cambiar_estado_cliente(id, estado):
+    """UPDATE directo del estado; fecha_actualizacion se actualiza por su onupdate"""
+    db.session.execute(db.update(Cliente).where(Cliente.id == id).values(estado=estado))
+
+
 @app.route('/api/clientes', methods=['GET'])
 @login_required
 def obtener_clientes():
     """Obtener lista de clientes"""
-    clientes = Cliente.query.order_by(Cliente.fecha_registro.desc()).all()
-    return jsonify({
+    return json_response({
         'success': True,
-        'clientes': [c.to_dict() for c in clientes]
+        'clientes': _clientes_api()
     })
 
 
+def _clientes_api():
+    """Clientes como dicts (mismo formato que Cliente.to_dict) sin construir objetos ORM"""
+    return list(_iter_clientes_api())
+
+
+def _iter_clientes_api(yield_per=None):
+    """Igual que _clientes_api() pero fila por fila (con yield_per se leen de la BD por bloques)"""
+    from sqlalchemy import select
+    # Tuplas en lugar de objetos ORM: sin identity map ni construcción de instancias
+    stmt = select(*[getattr(Cliente, c) for c in CLIENTE_API_COLS]).order_by(Cliente.fecha_registro.desc())
+    if yield_per:
+        stmt = stmt.execution_options(yield_per=yield_per)
+    for r in db.session.execute(stmt):
+        c = dict(zip(CLIENTE_API_COLS, r))
+        c['fecha_ultimo_pago'] = _fmt_d(c['fecha_ultimo_pago'])
+        c['fecha_proximo_pago'] = _fmt_d(c['fecha_proximo_pago'])
+        c['fecha_registro'] = _fmt_dt(c['fecha_registro'])
+        yield c
+
+
 # ============== API PAGOS ==============
 
 @app.route('/api/cliente/<int:id>/meses-pendientes')
@@ -3438,10 +3758,6 @@ def obtener_clientes():
 def meses_pendientes_cliente(id):
     """Devuelve los meses que el cliente tiene pendientes de pago, para elegir en Registrar Pago."""
     cliente = Cliente.query.get_or_404(id)
-    meses_nombres = {
-        1: 'Enero', 2: 'Febrero', 3: 'Marzo', 4: 'Abril', 5: 'Mayo', 6: 'Junio',
-        7: 'Julio', 8: 'Agosto', 9: 'Septiembre', 10: 'Octubre', 11: 'Noviembre', 12: 'Diciembre'
-    }
     hoy = datetime.now()
     precio = cliente.precio_mensual or 0
     meses = []
@@ -3451,7 +3767,7 @@ def meses_pendientes_cliente(id):
         while (anio, mes) <= (hoy.year, hoy.month):
             meses.append({
                 'value': f"{anio}-{mes:02d}",
-                'label': f"{meses_nombres[mes]} {anio}",
+                'label': f"{MESES_NOMBRES[mes]} {anio}",
                 'monto': round(precio, 2)
             })
             mes += 1
@@ -3463,7 +3779,7 @@ def meses_pendientes_cliente(id):
         # Cliente al día: se ofrece el mes actual por si se quiere registrar un pago adelantado
         meses.append({
             'value': hoy.strftime('%Y-%m'),
-            'label': f"{meses_nombres[hoy.month]} {hoy.year}",
+            'label': f"{MESES_NOMBRES[hoy.month]} {hoy.year}",
             'monto': round(precio, 2)
         })
 
@@ -3480,12 +3796,18 @@ def registrar_pago():
     """Registrar un nuevo pago"""
     try:
         data = request.get_json()
+        ahora = datetime.now()  # Una sola lectura del reloj para todo el registro
         
         cliente_id = data.get('cliente_id')
         if not cliente_id:
             return jsonify({'success': False, 'error': 'Cliente requerido'}), 400
         
-        cliente = Cliente.query.get(cliente_id)
+        # Solo las columnas que intervienen en el cálculo del pago y la reactivación
+        cliente = db.session.get(Cliente, cliente_id, options=[load_only(
+            Cliente.id, Cliente.nombre, Cliente.ip_address, Cliente.estado, Cliente.mikrotik_id,
+            Cliente.dia_corte, Cliente.precio_mensual, Cliente.saldo_pendiente,
+            Cliente.fecha_proximo_pago, Cliente.fecha_ultimo_pago
+        )])
         if not cliente:
             return jsonify({'success': False, 'error': 'Cliente no encontrado'}), 404
         
@@ -3493,7 +3815,7 @@ def registrar_pago():
         if monto <= 0:
             return jsonify({'success': False, 'error': 'Monto debe ser mayor a 0'}), 400
 
-        mes_pago = data.get('mes_correspondiente', datetime.now().strftime('%Y-%m'))
+        mes_pago = data.get('mes_correspondiente', ahora.strftime('%Y-%m'))
         precio = cliente.precio_mensual or 0
 
         # Si hay meses completos ya vencidos entre la fecha de próximo pago y el mes que se
@@ -3503,18 +3825,14 @@ def registrar_pago():
         meses_atrasados = calcular_meses_atrasados(cliente, mes_pago)
         if meses_atrasados > 0:
             cliente.saldo_pendiente = (cliente.saldo_pendiente or 0) + meses_atrasados * precio
-            anio_fp = cliente.fecha_proximo_pago.year
-            mes_fp = cliente.fecha_proximo_pago.month + meses_atrasados
-            while mes_fp > 12:
-                mes_fp -= 12
-                anio_fp += 1
+            anio_fp, mes_fp = sumar_meses(cliente.fecha_proximo_pago.year, cliente.fecha_proximo_pago.month, meses_atrasados)
             cliente.fecha_proximo_pago = datetime(anio_fp, mes_fp, min(cliente.dia_corte, 28))
 
         # ¿Ya había algún pago registrado para este mismo mes? Si es el primer pago del mes,
         # la deuda a cubrir es el saldo que arrastraba (ya incluye meses atrasados) + la cuota
         # de este mes. Si es un abono adicional al mismo mes (ya iniciado), no se vuelve a sumar
         # la cuota (ya quedó reflejada en el saldo_pendiente que dejó el abono anterior).
-        ya_pago_este_mes = Pago.query.filter_by(cliente_id=cliente_id, mes_correspondiente=mes_pago).first() is not None
+        ya_pago_este_mes = db.session.query(Pago.id).filter_by(cliente_id=cliente_id, mes_correspondiente=mes_pago).first() is not None
         saldo_previo = cliente.saldo_pendiente or 0
         deuda_total = saldo_previo if ya_pago_este_mes else saldo_previo + precio
         saldo_restante = round(deuda_total - monto, 2)
@@ -3533,7 +3851,7 @@ def registrar_pago():
         db.session.add(pago)
 
         # Actualizar cliente
-        cliente.fecha_ultimo_pago = datetime.now()
+        cliente.fecha_ultimo_pago = ahora
 
         if precio > 0 and saldo_restante > 0:
             # Pago parcial: queda saldo pendiente (incluye deuda anterior no cubierta)
@@ -3547,10 +3865,8 @@ def registrar_pago():
             try:
                 anio_pago, mes_num_pago = map(int, mes_pago.split('-'))
             except (ValueError, AttributeError):
-                hoy = datetime.now()
-                anio_pago, mes_num_pago = hoy.year, hoy.month
-            next_month = mes_num_pago + 1 if mes_num_pago < 12 else 1
-            next_year = anio_pago if mes_num_pago < 12 else anio_pago + 1
+                anio_pago, mes_num_pago = ahora.year, ahora.month
+            next_year, next_month = sumar_meses(anio_pago, mes_num_pago, 1)
             dia = min(cliente.dia_corte, 28)
             nueva_fecha_proximo = datetime(next_year, next_month, dia)
             # Nunca retroceder la fecha si ya estaba más adelante (ej. pagos adelantados previos)
@@ -3568,6 +3884,7 @@ def registrar_pago():
             cliente.estado = 'activo'
         
         db.session.commit()
+        invalidate_dashboard_cache()
         registrar_auditoria('pago', 'pago', pago.id, f'Pago Q{monto} de {cliente.nombre}')
         
         return jsonify({
@@ -3599,6 +3916,7 @@ def eliminar_pago(pago_id):
         monto_pago = pago.monto
         db.session.delete(pago)
         db.session.commit()
+        invalidate_dashboard_cache()
         registrar_auditoria('eliminar', 'pago', pago_id, f'Pago Q{monto_pago} eliminado de {cliente_nombre}')
         
         return jsonify({'success': True, 'message': 'Pago eliminado exitosamente'})
@@ -3607,22 +3925,42 @@ def eliminar_pago(pago_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Claves de Pago.to_dict, en el orden de las columnas que selecciona _pagos_api()
+PAGO_API_COLS = ('id', 'cliente_id', 'cliente_nombre', 'monto', 'fecha_pago',
+                 'mes_correspondiente', 'metodo_pago', 'referencia', 'notas')
+
+
+def _pagos_api(*criterios, limit=None):
+    """Pagos como dicts (mismo formato que Pago.to_dict) sin construir objetos ORM"""
+    return list(_iter_pagos_api(*criterios, limit=limit))
+
+
+def _iter_pagos_api(*criterios, limit=None, yield_per=None):
+    """Igual que _pagos_api() pero fila por fila (con yield_per se leen de la BD por bloques)"""
+    query = db.session.query(
+        Pago.id, Pago.cliente_id, Cliente.nombre, Pago.monto, Pago.fecha_pago,
+        Pago.mes_correspondiente, Pago.metodo_pago, Pago.referencia, Pago.notas
+    ).outerjoin(Cliente, Pago.cliente_id == Cliente.id).filter(*criterios).order_by(Pago.fecha_pago.desc())
+    if limit:
+        query = query.limit(limit)
+    if yield_per:
+        query = query.yield_per(yield_per)
+    for r in query:
+        p = dict(zip(PAGO_API_COLS, r))
+        p['fecha_pago'] = _fmt_dt(p['fecha_pago'])
+        yield p
+
+
 @app.route('/api/pagos', methods=['GET'])
 @login_required
 def obtener_pagos():
     """Obtener lista de pagos"""
     cliente_id = request.args.get('cliente_id')
+    criterios = [Pago.cliente_id == cliente_id] if cliente_id else []
     
-    query = Pago.query.order_by(Pago.fecha_pago.desc())
-    
-    if cliente_id:
-        query = query.filter_by(cliente_id=cliente_id)
-    
-    pagos = query.limit(100).all()
-    
-    return jsonify({
+    return json_response({
         'success': True,
-        'pagos': [p.to_dict() for p in pagos]
+        'pagos': _pagos_api(*criterios, limit=100)
     })
 
 
@@ -3630,15 +3968,92 @@ def obtener_pagos():
 @login_required
 def obtener_pagos_cliente(cliente_id):
     """Obtener historial de pagos de un cliente"""
-    pagos = Pago.query.filter_by(cliente_id=cliente_id).order_by(Pago.fecha_pago.desc()).all()
-    return jsonify({
+    return json_response({
         'success': True,
-        'pagos': [p.to_dict() for p in pagos]
+        'pagos': _pagos_api(Pago.cliente_id == cliente_id)
     })
 
 
 # ============== IMPORTAR/EXPORTAR EXCEL ==============
 
+IMPORT_BATCH_SIZE = 1000  # Filas por INSERT multi-fila al importar clientes
+
+# Encabezados aceptados por campo (en minúsculas), en orden de prioridad
+IMPORT_ALIAS_COLUMNAS = {
+    'nombre': ('nombre', 'nombre del cliente', 'nombre cliente', 'cliente'),
+    'ip': ('ip', 'ip_address', 'ip address', 'direccion ip'),
+    'plan': ('plan',),
+    'vel_down': ('velocidad download', 'velocidad bajada', 'velocidad_download', 'download'),
+    'vel_up': ('velocidad upload', 'velocidad subida', 'velocidad_upload', 'upload'),
+    'telefono': ('telefono', 'teléfono'),
+    'email': ('email', 'correo'),
+    'direccion': ('direccion', 'dirección'),
+    'cedula': ('cedula', 'cédula', 'cedula/dpi', 'dpi'),
+    'dia_corte': ('dia de corte', 'dia corte', 'dia_corte', 'día de corte'),
+    'precio': ('precio mensual (q)', 'precio mensual', 'precio_mensual', 'precio'),
+}
+
+
+def sincronizar_queues_importados(api, pendientes, nuevos_clientes, errores):
+    """Crea o actualiza en MikroTik los queues de los clientes importados.
+    Una sola lectura de /queue/simple para saber cuáles ya existen y luego escrituras en paralelo."""
+    _, por_target = api.build_queue_target_index()
+    actualizar, crear = [], []
+    for idx, row_num, queue, ip in pendientes:
+        existing_id = por_target.get(ip if '/32' in ip else f"{ip}/32")
+        if existing_id:
+            actualizar.append((idx, row_num, existing_id, queue))
+        else:
+            crear.append((idx, row_num, dict(queue, target=ip)))
+    
+    resultados = api.update_many_simple_queues([(qid, queue) for _, _, qid, queue in actualizar])
+    for (idx, row_num, _, _), (queue_id, success, result) in zip(actualizar, resultados):
+        if success:
+            nuevos_clientes[idx]['mikrotik_id'] = queue_id
+        else:
+            errores.append(f"Fila {row_num}: Error al actualizar queue existente - {result}")
+    
+    resultados = api.create_many_simple_queues([queue for _, _, queue in crear])
+    for (idx, row_num, _), (success, result) in zip(crear, resultados):
+        if success:
+            nuevos_clientes[idx]['mikrotik_id'] = result
+        else:
+            errores.append(f"Fila {row_num}: Queue no creado - {result}")
+
+
+@functools.lru_cache(maxsize=None)
+def estilos_encabezado_excel():
+    """Importa openpyxl la primera vez que se exporta y reutiliza los estilos del encabezado.
+    Devuelve None si openpyxl no está instalado."""
+    try:
+        from openpyxl.styles import Font, PatternFill, Alignment
+    except ImportError:
+        return None
+    return (
+        PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid"),
+        Font(color="FFFFFF", bold=True),
+        Alignment(horizontal='center'),
+    )
+
+
+def mapear_columnas_importacion(headers):
+    """Resuelve una sola vez por archivo qué columnas (índices) alimentan cada campo"""
+    posiciones = {}
+    for i, h in enumerate(headers):
+        posiciones.setdefault(str(h).lower().strip(), i)
+    return {
+        campo: tuple(posiciones[a] for a in alias if a in posiciones)
+        for campo, alias in IMPORT_ALIAS_COLUMNAS.items()
+    }
+
+
+def valor_importacion(row, indices, default=''):
+    """Primer valor no vacío de la fila entre las columnas del campo (mismo criterio que 'a or b or c')"""
+    for i in indices:
+        if i < len(row) and row[i]:
+            return row[i]
+    return default
+
 @app.route('/api/clientes/exportar', methods=['GET'])
 @login_required
 def exportar_clientes():
@@ -3646,65 +4061,58 @@ def exportar_clientes():
     try:
         router_id = request.args.get('router_id', type=int)
         # Intentar usar openpyxl
-        try:
-            from openpyxl import Workbook
-            from openpyxl.styles import Font, PatternFill, Alignment
-        except ImportError:
+        estilos = estilos_encabezado_excel()
+        if estilos is None:
             # Si no está instalado, exportar como CSV
             return exportar_clientes_csv(router_id=router_id)
         
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.utils import get_column_letter
+        from sqlalchemy import func, cast, String
+        
         query = Cliente.query
         if router_id:
             query = query.filter_by(router_id=router_id)
-        clientes = query.order_by(Cliente.nombre).all()
         
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Clientes"
+        columnas = (Cliente.id, Cliente.nombre, Cliente.ip_address, Cliente.plan,
+                    Cliente.velocidad_download, Cliente.velocidad_upload, Cliente.telefono,
+                    Cliente.email, Cliente.direccion, Cliente.cedula, Cliente.estado,
+                    Cliente.dia_corte, Cliente.precio_mensual, Cliente.fecha_registro)
+        
+        # Workbook de solo escritura: las filas se vuelcan a disco a medida que se escriben
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Clientes")
         
         # Encabezados
         headers = ['ID', 'Nombre', 'IP', 'Plan', 'Velocidad Bajada', 'Velocidad Subida', 
                    'Telefono', 'Email', 'Direccion', 'Cedula', 'Estado', 'Dia Corte',
                    'Precio Mensual', 'Fecha Registro']
         
-        header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-        header_font = Font(color="FFFFFF", bold=True)
+        # Ajustar anchos de columna (en modo write-only deben definirse antes de escribir filas,
+        # así que el largo máximo de cada columna se calcula en SQL; la fecha siempre mide 10)
+        largos = query.with_entities(
+            *[func.max(func.length(cast(col, String))) for col in columnas[:-1]]
+        ).one()
+        for col, (header, largo) in enumerate(zip(headers, list(largos) + [10]), 1):
+            ws.column_dimensions[get_column_letter(col)].width = min(max(len(header), largo or 0) + 2, 50)
         
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
+        header_fill, header_font, header_alignment = estilos
+        
+        header_row = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
             cell.fill = header_fill
             cell.font = header_font
-            cell.alignment = Alignment(horizontal='center')
+            cell.alignment = header_alignment
+            header_row.append(cell)
+        ws.append(header_row)
         
-        # Datos
-        for row, cliente in enumerate(clientes, 2):
-            ws.cell(row=row, column=1, value=cliente.id)
-            ws.cell(row=row, column=2, value=cliente.nombre)
-            ws.cell(row=row, column=3, value=cliente.ip_address)
-            ws.cell(row=row, column=4, value=cliente.plan)
-            ws.cell(row=row, column=5, value=cliente.velocidad_download)
-            ws.cell(row=row, column=6, value=cliente.velocidad_upload)
-            ws.cell(row=row, column=7, value=cliente.telefono)
-            ws.cell(row=row, column=8, value=cliente.email)
-            ws.cell(row=row, column=9, value=cliente.direccion)
-            ws.cell(row=row, column=10, value=cliente.cedula)
-            ws.cell(row=row, column=11, value=cliente.estado)
-            ws.cell(row=row, column=12, value=cliente.dia_corte)
-            ws.cell(row=row, column=13, value=cliente.precio_mensual)
-            ws.cell(row=row, column=14, value=cliente.fecha_registro.strftime('%Y-%m-%d') if cliente.fecha_registro else '')
-        
-        # Ajustar anchos de columna
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column].width = adjusted_width
+        # Datos (tuplas por lotes, sin instanciar objetos Cliente)
+        for fila in query.with_entities(*columnas).order_by(Cliente.nombre).yield_per(1000):
+            *valores, fecha_registro = fila
+            valores.append(_fmt_d(fecha_registro) or '')
+            ws.append(valores)
         
         # Guardar en memoria
         output = BytesIO()
@@ -3730,32 +4138,36 @@ def exportar_clientes_csv(router_id=None):
     query = Cliente.query
     if router_id:
         query = query.filter_by(router_id=router_id)
-    clientes = query.order_by(Cliente.nombre).all()
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    # Encabezados
-    writer.writerow(['ID', 'Nombre', 'IP', 'Plan', 'Velocidad Bajada', 'Velocidad Subida', 
-                     'Telefono', 'Email', 'Direccion', 'Cedula', 'Estado', 'Dia Corte',
-                     'Precio Mensual', 'Fecha Registro'])
-    
-    # Datos
-    for cliente in clientes:
-        writer.writerow([
-            cliente.id, cliente.nombre, cliente.ip_address, cliente.plan,
-            cliente.velocidad_download, cliente.velocidad_upload, cliente.telefono,
-            cliente.email, cliente.direccion, cliente.cedula, cliente.estado,
-            cliente.dia_corte, cliente.precio_mensual,
-            cliente.fecha_registro.strftime('%Y-%m-%d') if cliente.fecha_registro else ''
-        ])
-    
-    output.seek(0)
-    return send_file(
-        BytesIO(output.getvalue().encode('utf-8')),
+    filas = query.with_entities(
+        Cliente.id, Cliente.nombre, Cliente.ip_address, Cliente.plan,
+        Cliente.velocidad_download, Cliente.velocidad_upload, Cliente.telefono,
+        Cliente.email, Cliente.direccion, Cliente.cedula, Cliente.estado,
+        Cliente.dia_corte, Cliente.precio_mensual, Cliente.fecha_registro
+    ).order_by(Cliente.nombre).yield_per(500)
+    
+    def generar():
+        # Un único buffer pequeño que se vacía después de cada fila
+        output = StringIO()
+        writer = csv.writer(output)
+        
+        # Encabezados
+        writer.writerow(['ID', 'Nombre', 'IP', 'Plan', 'Velocidad Bajada', 'Velocidad Subida', 
+                         'Telefono', 'Email', 'Direccion', 'Cedula', 'Estado', 'Dia Corte',
+                         'Precio Mensual', 'Fecha Registro'])
+        
+        # Datos
+        for *valores, fecha_registro in filas:
+            valores.append(_fmt_d(fecha_registro) or '')
+            writer.writerow(valores)
+            yield output.getvalue().encode('utf-8')
+            output.seek(0)
+            output.truncate()
+        yield output.getvalue().encode('utf-8')
+    
+    return Response(
+        stream_with_context(generar()),
         mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'clientes_{datetime.now().strftime("%Y%m%d")}.csv'
+        headers={'Content-Disposition': f'attachment; filename=clientes_{datetime.now().strftime("%Y%m%d")}.csv'}
     )
 
 
@@ -3784,129 +4196,77 @@ def importar_clientes():
         clientes_importados = 0
         clientes_omitidos = 0
         errores = []
+        # Filas válidas a insertar en bloque al final (sin ORM por fila)
+        nuevos_clientes = []
+        # IPs ya usadas: las de la base (una sola consulta) más las que se van leyendo del archivo
+        ips_ocupadas = set(db.session.execute(db.select(Cliente.ip_address)).scalars())
         
         if filename.endswith('.xlsx') or filename.endswith('.xls'):
             # Importar desde Excel
             try:
                 from openpyxl import load_workbook
                 
-                wb = load_workbook(file)
+                # Solo lectura y valores: filas como tuplas, sin objetos Cell ni estilos en memoria
+                wb = load_workbook(file, read_only=True, data_only=True)
                 ws = wb.active
+                filas = ws.iter_rows(values_only=True)
+                api = get_mikrotik_api(active_router_id)
+                queues_pendientes = []  # (índice en nuevos_clientes, fila, kwargs del queue, ip)
                 
-                # Obtener encabezados y normalizarlos
-                raw_headers = [cell.value if cell.value else '' for cell in ws[1]]
-                headers = [str(h).lower().strip() for h in raw_headers]
+                # Encabezados → índices de columna por campo, resuelto una vez por archivo
+                columnas = mapear_columnas_importacion(h if h else '' for h in next(filas, ()))
                 
-                for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), 2):
+                for row_num, row in enumerate(filas, 2):
                     try:
-                        data = dict(zip(headers, row))
-                        
-                        # Buscar nombre con varias variantes
-                        nombre = (data.get('nombre', '') or 
-                                 data.get('nombre del cliente', '') or 
-                                 data.get('nombre cliente', '') or 
-                                 data.get('cliente', ''))
-                        
-                        # Buscar IP con varias variantes
-                        ip = (data.get('ip', '') or 
-                             data.get('ip_address', '') or 
-                             data.get('ip address', '') or
-                             data.get('direccion ip', ''))
+                        nombre = valor_importacion(row, columnas['nombre'])
+                        ip = valor_importacion(row, columnas['ip'])
                         
                         if not nombre or not ip:
                             clientes_omitidos += 1
                             errores.append(f"Fila {row_num}: Falta nombre o IP")
                             continue
                         
-                        # Verificar si ya existe
-                        if Cliente.query.filter_by(ip_address=str(ip)).first():
+                        # Verificar si ya existe (en la base o repetida en el archivo)
+                        if str(ip) in ips_ocupadas:
                             clientes_omitidos += 1
                             errores.append(f"Fila {row_num}: IP {ip} ya existe")
                             continue
                         
-                        # Obtener plan
-                        plan = (data.get('plan', '') or 'Basico')
-                        
-                        # Obtener velocidades
-                        vel_down = (data.get('velocidad download', '') or 
-                                   data.get('velocidad bajada', '') or 
-                                   data.get('velocidad_download', '') or 
-                                   data.get('download', '') or '10M')
-                        vel_up = (data.get('velocidad upload', '') or 
-                                 data.get('velocidad subida', '') or 
-                                 data.get('velocidad_upload', '') or 
-                                 data.get('upload', '') or '5M')
-                        
-                        # Obtener otros datos
-                        telefono = data.get('telefono', '') or data.get('teléfono', '') or ''
-                        email = data.get('email', '') or data.get('correo', '') or ''
-                        direccion = data.get('direccion', '') or data.get('dirección', '') or ''
-                        cedula = (data.get('cedula', '') or 
-                                 data.get('cédula', '') or 
-                                 data.get('cedula/dpi', '') or 
-                                 data.get('dpi', '') or '')
+                        plan = valor_importacion(row, columnas['plan'], 'Basico')
+                        vel_down = valor_importacion(row, columnas['vel_down'], '10M')
+                        vel_up = valor_importacion(row, columnas['vel_up'], '5M')
+                        telefono = valor_importacion(row, columnas['telefono'])
+                        email = valor_importacion(row, columnas['email'])
+                        direccion = valor_importacion(row, columnas['direccion'])
+                        cedula = valor_importacion(row, columnas['cedula'])
                         
                         # Obtener día de corte
-                        dia_corte_raw = (data.get('dia de corte', '') or 
-                                        data.get('dia corte', '') or 
-                                        data.get('dia_corte', '') or 
-                                        data.get('día de corte', '') or 1)
+                        dia_corte_raw = valor_importacion(row, columnas['dia_corte'], 1)
                         try:
                             dia_corte = int(dia_corte_raw) if dia_corte_raw else 1
                         except:
                             dia_corte = 1
                         
                         # Obtener precio
-                        precio_raw = (data.get('precio mensual (q)', '') or 
-                                     data.get('precio mensual', '') or 
-                                     data.get('precio_mensual', '') or 
-                                     data.get('precio', '') or 0)
+                        precio_raw = valor_importacion(row, columnas['precio'], 0)
                         try:
                             precio = float(precio_raw) if precio_raw else 0
                         except:
                             precio = 0
                         
                         # Generar nombre del queue
-                        nombre_limpio = str(nombre).replace(' ', '-').lower()[:30]
-                        queue_name = f"cliente-{nombre_limpio}-{str(ip).replace('.', '-')}"
-                        
-                        # Crear Simple Queue en MikroTik
-                        mikrotik_id = None
-                        api = get_mikrotik_api(active_router_id)
+                        queue_name = nombre_queue_cliente(nombre, ip)
                         
+                        # El queue en MikroTik se crea/actualiza en bloque después de leer todo el archivo
                         if api:
-                            # PRIMERO BUSCAR si ya existe el queue por IP
-                            found, existing_queue_id = api.find_queue_by_target(str(ip))
-                            
-                            if found and existing_queue_id:
-                                # Actualizar el existente
-                                success, result = api.update_simple_queue(
-                                    existing_queue_id,
-                                    name=queue_name,
-                                    max_limit_download=str(vel_down) if vel_down else '10M',
-                                    max_limit_upload=str(vel_up) if vel_up else '5M',
-                                    comment=f"Cliente: {nombre}"
-                                )
-                                if success:
-                                    mikrotik_id = existing_queue_id
-                                else:
-                                    errores.append(f"Fila {row_num}: Error al actualizar queue existente - {result}")
-                            else:
-                                # No existe, crearlo
-                                success, result = api.create_simple_queue(
-                                    name=queue_name,
-                                    target=str(ip),
-                                    max_limit_download=str(vel_down) if vel_down else '10M',
-                                    max_limit_upload=str(vel_up) if vel_up else '5M',
-                                    comment=f"Cliente: {nombre}"
-                                )
-                                
-                                if success:
-                                    mikrotik_id = result
-                                else:
-                                    errores.append(f"Fila {row_num}: Queue no creado - {result}")
+                            queues_pendientes.append((len(nuevos_clientes), row_num, dict(
+                                name=queue_name,
+                                max_limit_download=str(vel_down) if vel_down else '10M',
+                                max_limit_upload=str(vel_up) if vel_up else '5M',
+                                comment=f"Cliente: {nombre}"
+                            ), str(ip)))
                         
-                        cliente = Cliente(
+                        nuevos_clientes.append(dict(
                             nombre=str(nombre),
                             ip_address=str(ip),
                             plan=str(plan) if plan else 'Basico',
@@ -3920,71 +4280,105 @@ def importar_clientes():
                             dia_corte=dia_corte,
                             precio_mensual=precio,
                             queue_name=queue_name,
-                            mikrotik_id=mikrotik_id,
+                            mikrotik_id=None,
                             router_id=active_router_id
-                        )
-                        
-                        db.session.add(cliente)
+                        ))
+                        ips_ocupadas.add(str(ip))
                         clientes_importados += 1
                         
                     except Exception as e:
                         errores.append(f"Fila {row_num}: {str(e)}")
                         clientes_omitidos += 1
                 
+                wb.close()
+                
+                if queues_pendientes:
+                    sincronizar_queues_importados(api, queues_pendientes, nuevos_clientes, errores)
+                
             except ImportError:
                 return jsonify({'success': False, 'error': 'Libreria openpyxl no instalada'}), 500
         
         elif filename.endswith('.csv'):
             # Importar desde CSV
             import csv
-            from io import StringIO
+            from io import TextIOWrapper
+            from sqlalchemy import insert
             
-            content = file.read().decode('utf-8')
-            reader = csv.DictReader(StringIO(content))
+            # Leer el archivo en flujo (sin cargarlo completo) e insertar/confirmar por bloques
+            reader = csv.reader(TextIOWrapper(file.stream, encoding='utf-8', newline=''))
+            # Encabezados → índice de columna, resuelto una sola vez (no por fila)
+            encabezados = [h.strip().lower() for h in next(reader, [])]
+            
+            def columna(*alias):
+                """Índice del primer alias presente en el encabezado, o None"""
+                return next((encabezados.index(a) for a in alias if a in encabezados), None)
+            
+            def valor(row, i, default=''):
+                return row[i] if i is not None and i < len(row) else default
+            
+            i_nombre = columna('nombre')
+            i_ip = columna('ip', 'ip_address')
+            i_plan = columna('plan')
+            i_vel_down = columna('velocidad bajada', 'velocidad_download')
+            i_vel_up = columna('velocidad subida', 'velocidad_upload')
+            i_telefono = columna('telefono')
+            i_email = columna('email')
+            i_direccion = columna('direccion')
+            i_cedula = columna('cedula')
+            i_dia_corte = columna('dia corte', 'dia_corte')
+            i_precio = columna('precio mensual', 'precio_mensual')
             
             for row_num, row in enumerate(reader, 2):
+                if not row:
+                    continue
                 try:
-                    # Normalizar nombres de columnas
-                    data = {k.lower(): v for k, v in row.items()}
-                    
-                    nombre = data.get('nombre', '')
-                    ip = data.get('ip', data.get('ip_address', ''))
+                    nombre = valor(row, i_nombre)
+                    ip = valor(row, i_ip)
                     
                     if not nombre or not ip:
                         clientes_omitidos += 1
                         continue
                     
-                    # Verificar si ya existe
-                    if Cliente.query.filter_by(ip_address=ip).first():
+                    # Verificar si ya existe (en la base o repetida en el archivo)
+                    if ip in ips_ocupadas:
                         clientes_omitidos += 1
                         continue
                     
-                    cliente = Cliente(
+                    nuevos_clientes.append(dict(
                         nombre=nombre,
                         ip_address=ip,
-                        plan=data.get('plan', 'Basico'),
-                        velocidad_download=data.get('velocidad bajada', data.get('velocidad_download', '10M')),
-                        velocidad_upload=data.get('velocidad subida', data.get('velocidad_upload', '5M')),
-                        telefono=data.get('telefono', ''),
-                        email=data.get('email', ''),
-                        direccion=data.get('direccion', ''),
-                        cedula=data.get('cedula', ''),
+                        plan=valor(row, i_plan, 'Basico'),
+                        velocidad_download=valor(row, i_vel_down, '10M'),
+                        velocidad_upload=valor(row, i_vel_up, '5M'),
+                        telefono=valor(row, i_telefono),
+                        email=valor(row, i_email),
+                        direccion=valor(row, i_direccion),
+                        cedula=valor(row, i_cedula),
                         estado='activo',
-                        dia_corte=int(data.get('dia corte', data.get('dia_corte', 1)) or 1),
-                        precio_mensual=float(data.get('precio mensual', data.get('precio_mensual', 0)) or 0)
-                    )
-                    
-                    db.session.add(cliente)
+                        dia_corte=int(valor(row, i_dia_corte, 1) or 1),
+                        precio_mensual=float(valor(row, i_precio, 0) or 0)
+                    ))
+                    ips_ocupadas.add(ip)
                     clientes_importados += 1
                     
                 except Exception as e:
                     errores.append(f"Fila {row_num}: {str(e)}")
                     clientes_omitidos += 1
+                    continue
+                
+                if len(nuevos_clientes) >= IMPORT_BATCH_SIZE:
+                    db.session.execute(insert(Cliente), nuevos_clientes)
+                    db.session.commit()
+                    nuevos_clientes.clear()
         
         else:
             return jsonify({'success': False, 'error': 'Formato no soportado. Use .xlsx, .xls o .csv'}), 400
         
+        from sqlalchemy import insert
+        for i in range(0, len(nuevos_clientes), IMPORT_BATCH_SIZE):
+            db.session.execute(insert(Cliente), nuevos_clientes[i:i + IMPORT_BATCH_SIZE])
         db.session.commit()
+        invalidate_dashboard_cache()
         
         return jsonify({
             'success': True,
@@ -4006,47 +4400,57 @@ def importar_clientes():
 def reporte_resumen():
     """Reporte resumen general"""
     try:
-        total_clientes = Cliente.query.count()
-        clientes_activos = Cliente.query.filter_by(estado='activo').count()
-        clientes_suspendidos = Cliente.query.filter_by(estado='suspendido').count()
-        clientes_cortados = Cliente.query.filter_by(estado='cortado').count()
-        
-        # Pagos del mes
-        hoy = datetime.now()
-        primer_dia_mes = hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        pagos_mes = Pago.query.filter(Pago.fecha_pago >= primer_dia_mes).all()
-        total_recaudado = sum(p.monto for p in pagos_mes)
-        
-        # Proyección mensual
-        total_mensual_esperado = db.session.query(db.func.sum(Cliente.precio_mensual)).filter(
-            Cliente.estado == 'activo'
-        ).scalar() or 0
-        
-        # Clientes por plan
-        from sqlalchemy import func
-        clientes_por_plan = db.session.query(
-            Cliente.plan, 
-            func.count(Cliente.id)
-        ).group_by(Cliente.plan).all()
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'total_clientes': total_clientes,
-                'clientes_activos': clientes_activos,
-                'clientes_suspendidos': clientes_suspendidos,
-                'clientes_cortados': clientes_cortados,
-                'total_recaudado_mes': total_recaudado,
-                'total_mensual_esperado': total_mensual_esperado,
-                'porcentaje_recaudado': (total_recaudado / total_mensual_esperado * 100) if total_mensual_esperado > 0 else 0,
-                'clientes_por_plan': [{'plan': p[0], 'cantidad': p[1]} for p in clientes_por_plan]
-            }
-        })
-        
+        return jsonify(cache_dashboard('resumen', _calcular_resumen))
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _calcular_resumen():
+    """Datos del reporte resumen (sin serializar, para la caché)"""
+    from sqlalchemy import func, case
+    
+    hoy = datetime.now()
+    primer_dia_mes = hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    
+    def contar_estado(estado):
+        return func.coalesce(func.sum(case((Cliente.estado == estado, 1), else_=0)), 0)
+    
+    # Conteos, proyección y pagos del mes en una sola consulta (pagos como subconsulta escalar)
+    recaudado_mes = db.select(func.coalesce(func.sum(Pago.monto), 0)).where(
+        Pago.fecha_pago >= primer_dia_mes
+    ).scalar_subquery()
+    (total_clientes, clientes_activos, clientes_suspendidos, clientes_cortados,
+     total_mensual_esperado, total_recaudado) = db.session.execute(db.select(
+        func.count(Cliente.id),
+        contar_estado('activo'),
+        contar_estado('suspendido'),
+        contar_estado('cortado'),
+        func.sum(case((Cliente.estado == 'activo', Cliente.precio_mensual))),
+        recaudado_mes
+    )).one()
+    total_mensual_esperado = total_mensual_esperado or 0
+    
+    # Clientes por plan
+    clientes_por_plan = db.session.query(
+        Cliente.plan, 
+        func.count(Cliente.id)
+    ).group_by(Cliente.plan).all()
+    
+    return {
+        'success': True,
+        'data': {
+            'total_clientes': total_clientes,
+            'clientes_activos': clientes_activos,
+            'clientes_suspendidos': clientes_suspendidos,
+            'clientes_cortados': clientes_cortados,
+            'total_recaudado_mes': total_recaudado,
+            'total_mensual_esperado': total_mensual_esperado,
+            'porcentaje_recaudado': (total_recaudado / total_mensual_esperado * 100) if total_mensual_esperado > 0 else 0,
+            'clientes_por_plan': [{'plan': p[0], 'cantidad': p[1]} for p in clientes_por_plan]
+        }
+    }
+
+
 @app.route('/api/reportes/pagos-mensuales', methods=['GET'])
 @login_required
 def reporte_pagos_mensuales():
@@ -4085,7 +4489,7 @@ def reporte_pagos_mensuales():
 def generar_recibo(pago_id):
     """Generar recibo de pago (HTML para imprimir)"""
     try:
-        pago = Pago.query.get_or_404(pago_id)
+        pago = Pago.query.options(joinedload(Pago.cliente)).filter_by(id=pago_id).first_or_404()
         cliente = pago.cliente
         
         return render_template('recibo.html', pago=pago, cliente=cliente)
@@ -4151,10 +4555,10 @@ def guardar_config_mikrotik():
 
         db.session.add(config)
         db.session.commit()
+        invalidate_mt_cache(config.id)
 
         # Limpiar caché de estado
-        global _mikrotik_status_cache
-        _mikrotik_status_cache = {'connected': False, 'message': '', 'queue_count': 0, 'last_check': None}
+        invalidate_mikrotik_status()
 
         return jsonify({'success': True, 'message': 'Router guardado correctamente', 'id': config.id})
 
@@ -4173,10 +4577,10 @@ def eliminar_router_mikrotik(router_id):
             return jsonify({'success': False, 'error': 'Router no encontrado'}), 404
         db.session.delete(config)
         db.session.commit()
+        invalidate_mt_cache(router_id)
 
         # Limpiar caché de estado
-        global _mikrotik_status_cache
-        _mikrotik_status_cache = {'connected': False, 'message': '', 'queue_count': 0, 'last_check': None}
+        invalidate_mikrotik_status()
 
         return jsonify({'success': True, 'message': 'Router eliminado'})
     except Exception as e:
@@ -4337,15 +4741,15 @@ def eliminar_infraestructura(infra_id):
 @login_required
 def obtener_planes():
     """Obtener lista de planes"""
-    planes = Plan.query.all()
+    planes = get_planes_cached()
     return jsonify({
         'success': True,
         'planes': [{
-            'id': p.id,
-            'nombre': p.nombre,
-            'velocidad_download': p.velocidad_download,
-            'velocidad_upload': p.velocidad_upload,
-            'precio': p.precio
+            'id': p['id'],
+            'nombre': p['nombre'],
+            'velocidad_download': p['velocidad_download'],
+            'velocidad_upload': p['velocidad_upload'],
+            'precio': p['precio']
         } for p in planes]
     })
 
@@ -4367,6 +4771,7 @@ def crear_plan():
         
         db.session.add(plan)
         db.session.commit()
+        invalidate_planes_cache()
         
         return jsonify({'success': True, 'message': 'Plan creado'})
         
@@ -4390,6 +4795,7 @@ def editar_plan(id):
         plan.descripcion = data.get('descripcion', plan.descripcion)
         
         db.session.commit()
+        invalidate_planes_cache()
         return jsonify({'success': True, 'message': 'Plan actualizado'})
     except Exception as e:
         db.session.rollback()
@@ -4404,6 +4810,7 @@ def eliminar_plan(id):
         plan = Plan.query.get_or_404(id)
         db.session.delete(plan)
         db.session.commit()
+        invalidate_planes_cache()
         return jsonify({'success': True, 'message': 'Plan eliminado'})
     except Exception as e:
         db.session.rollback()
@@ -4424,7 +4831,7 @@ def sincronizar_queues():
         success, queues = api.get_simple_queues()
         
         if success:
-            return jsonify({'success': True, 'queues': queues})
+            return json_response({'success': True, 'queues': queues})
         else:
             return jsonify({'success': False, 'error': queues}), 500
             
@@ -4449,6 +4856,9 @@ def importar_queues_mikrotik():
         importados = 0
         omitidos = 0
         errores = []
+        # IPs ya registradas, en una sola consulta (incluye las que se agregan en este recorrido)
+        ips_existentes = set(db.session.execute(db.select(Cliente.ip_address)).scalars())
+        nuevos_clientes = []
         
         for queue in queues:
             try:
@@ -4460,16 +4870,19 @@ def importar_queues_mikrotik():
                 queue_id = queue.get('.id', '')
                 disabled = queue.get('disabled', 'false') == 'true'
                 
-                # Extraer IP del target (formato: IP/32 o IP)
-                ip_address = target.replace('/32', '').strip()
+                # Extraer IP del target (formato: IP/32 o IP); subredes y targets múltiples se omiten
+                ip_address = target.strip().removesuffix('/32')
+                if '/' in ip_address or ',' in ip_address:
+                    continue
                 
-                # Validar IP
-                if not ip_address or not ip_address.replace('.', '').isdigit() or ip_address.count('.') != 3:
+                # Validar IP (IPv4 canónica: rechaza octetos > 255, hex, ceros a la izquierda y espacios)
+                try:
+                    ipaddress.IPv4Address(ip_address)
+                except ValueError:
                     continue
                 
                 # Verificar si ya existe un cliente con esa IP
-                cliente_existente = Cliente.query.filter_by(ip_address=ip_address).first()
-                if cliente_existente:
+                if ip_address in ips_existentes:
                     omitidos += 1
                     continue
                 
@@ -4478,26 +4891,29 @@ def importar_queues_mikrotik():
                 vel_upload = velocidades[0] if len(velocidades) > 0 else '5M'
                 vel_download = velocidades[1] if len(velocidades) > 1 else '10M'
                 
-                # Crear nuevo cliente
-                nuevo_cliente = Cliente(
+                # Fila del nuevo cliente (se inserta en bloque al final)
+                nuevos_clientes.append(dict(
                     nombre=nombre,
                     ip_address=ip_address,
                     plan=comment if comment else 'Importado de MikroTik',
                     velocidad_download=vel_download,
                     velocidad_upload=vel_upload,
                     estado='activo' if not disabled else 'suspendido',
-                    queue_id=queue_id,
+                    mikrotik_id=queue_id,
                     queue_name=nombre
-                )
-                
-                db.session.add(nuevo_cliente)
+                ))
+                ips_existentes.add(ip_address)
                 importados += 1
                 
             except Exception as e:
                 errores.append(f"{nombre}: {str(e)}")
                 continue
         
+        from sqlalchemy import insert
+        for i in range(0, len(nuevos_clientes), IMPORT_BATCH_SIZE):
+            db.session.execute(insert(Cliente), nuevos_clientes[i:i + IMPORT_BATCH_SIZE])
         db.session.commit()
+        invalidate_dashboard_cache()
         
         return jsonify({
             'success': True,
@@ -4514,6 +4930,37 @@ def importar_queues_mikrotik():
 
 # ============== INICIALIZAR DB ==============
 
+def abrir_transaccion_sqlite(conn):
+    """pysqlite no emite BEGIN antes de DDL ni de SAVEPOINT: sin un BEGIN explícito cada savepoint
+    es su propia transacción y su RELEASE la confirma. Fuera de SQLite no hace nada."""
+    if conn.dialect.name != 'sqlite':
+        return
+    dbapi_conn = conn.connection.dbapi_connection
+    if not dbapi_conn.in_transaction:
+        dbapi_conn.execute('BEGIN')
+
+
+def _agregar_columnas_faltantes(tabla, columnas, existentes):
+    """Agrega las columnas que falten en una sola transacción (un commit para todas).
+    Cada ALTER va en su propio savepoint para que un fallo no anule los demás."""
+    from sqlalchemy import text
+    agregadas = []
+    faltantes = [(nombre, tipo) for nombre, tipo in columnas.items() if nombre not in existentes]
+    if not faltantes:
+        return agregadas
+    with db.engine.begin() as conn:
+        abrir_transaccion_sqlite(conn)
+        for col_name, col_type in faltantes:
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(f'ALTER TABLE {tabla} ADD COLUMN {col_name} {col_type}'))
+                agregadas.append(col_name)
+                print(f"[MIGRATION] Columna '{col_name}' agregada a {tabla}")
+            except Exception as e:
+                print(f"[MIGRATION] Error agregando '{col_name}' a {tabla}: {e}")
+    return agregadas
+
+
 def migrate_db():
     """Agrega columnas faltantes a tablas existentes"""
     from sqlalchemy import text, inspect
@@ -4544,26 +4991,17 @@ def migrate_db():
                     'router_id': 'INTEGER',
                 }
                 
-                for col_name, col_type in columns_to_add.items():
-                    if col_name not in existing_columns:
-                        try:
+                agregadas = _agregar_columnas_faltantes('clientes', columns_to_add, existing_columns)
+                if 'router_id' in agregadas:
+                    try:
+                        first_r = ConfigMikroTik.query.first()
+                        if first_r:
                             with db.engine.connect() as conn:
-                                conn.execute(text(f'ALTER TABLE clientes ADD COLUMN {col_name} {col_type}'))
+                                conn.execute(text(f'UPDATE clientes SET router_id = {first_r.id} WHERE router_id IS NULL'))
                                 conn.commit()
-                            print(f"[MIGRATION] Columna '{col_name}' agregada a clientes")
-                            
-                            if col_name == 'router_id':
-                                try:
-                                    first_r = ConfigMikroTik.query.first()
-                                    if first_r:
-                                        with db.engine.connect() as conn:
-                                            conn.execute(text(f'UPDATE clientes SET router_id = {first_r.id} WHERE router_id IS NULL'))
-                                            conn.commit()
-                                        print(f"[MIGRATION] Asignados clientes existentes al router ID {first_r.id}")
-                                except Exception as inner_e:
-                                    print(f"[MIGRATION] Error al asignar router por defecto: {inner_e}")
-                        except Exception as e:
-                            print(f"[MIGRATION] Error agregando '{col_name}': {e}")
+                            print(f"[MIGRATION] Asignados clientes existentes al router ID {first_r.id}")
+                    except Exception as inner_e:
+                        print(f"[MIGRATION] Error al asignar router por defecto: {inner_e}")
                             
             # Verificar si la tabla usuarios existe
             if 'usuarios' in inspector.get_table_names():
@@ -4583,15 +5021,7 @@ def migrate_db():
                     'ultima_ip': 'VARCHAR(50)'
                 }
                 
-                for col_name, col_type in columns_to_add.items():
-                    if col_name not in existing_columns:
-                        try:
-                            with db.engine.connect() as conn:
-                                conn.execute(text(f'ALTER TABLE usuarios ADD COLUMN {col_name} {col_type}'))
-                                conn.commit()
-                            print(f"[MIGRATION] Columna '{col_name}' agregada a usuarios")
-                        except Exception as e:
-                            print(f"[MIGRATION] Error agregando '{col_name}' a usuarios: {e}")
+                _agregar_columnas_faltantes('usuarios', columns_to_add, existing_columns)
             # Verificar si la tabla omada_vouchers existe
             if 'omada_vouchers' in inspector.get_table_names():
                 existing_columns = [col['name'] for col in inspector.get_columns('omada_vouchers')]
@@ -4603,15 +5033,7 @@ def migrate_db():
                     'lote': 'VARCHAR(100)'
                 }
                 
-                for col_name, col_type in columns_to_add.items():
-                    if col_name not in existing_columns:
-                        try:
-                            with db.engine.connect() as conn:
-                                conn.execute(text(f'ALTER TABLE omada_vouchers ADD COLUMN {col_name} {col_type}'))
-                                conn.commit()
-                            print(f"[MIGRATION] Columna '{col_name}' agregada a omada_vouchers")
-                        except Exception as e:
-                            print(f"[MIGRATION] Error agregando '{col_name}' a omada_vouchers: {e}")
+                _agregar_columnas_faltantes('omada_vouchers', columns_to_add, existing_columns)
 
             # Verificar si la tabla config_omada existe
             if 'config_omada' in inspector.get_table_names():
@@ -4710,6 +5132,29 @@ def migrate_db():
                             conn.commit()
                     except Exception as e:
                         print(f"[MIGRATION] Error vouchers 2: {e}")
+            # Índices para filtros frecuentes (create_all solo los crea en tablas nuevas)
+            indices = {
+                'ix_cliente_estado_proxpago': 'clientes (estado, fecha_proximo_pago)',
+                'ix_cliente_estado_diacorte': 'clientes (estado, dia_corte)',
+                'ix_cliente_fecha_registro': 'clientes (fecha_registro)',
+                'ix_cliente_geo': 'clientes (latitud, longitud) WHERE latitud IS NOT NULL',
+                'ix_clientes_queue_name': 'clientes (queue_name)',
+                'ix_clientes_mikrotik_id': 'clientes (mikrotik_id)',
+                'ix_pago_fecha': 'pagos (fecha_pago)',
+                'ix_pago_mes': 'pagos (mes_correspondiente)',
+                'ix_pago_cliente_fecha': 'pagos (cliente_id, fecha_pago)',
+                'ix_audit_fecha': 'audit_log (fecha)',
+            }
+            # Todos en una transacción; cada índice en su savepoint para que un fallo no anule los demás
+            with db.engine.begin() as conn:
+                abrir_transaccion_sqlite(conn)
+                for idx_name, idx_def in indices.items():
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {idx_name} ON {idx_def}'))
+                    except Exception as e:
+                        print(f"[MIGRATION] Error creando índice '{idx_name}': {e}")
+
             if 'clientes' in inspector.get_table_names():
                 try:
                     first_r = ConfigMikroTik.query.first()
@@ -4781,35 +5226,73 @@ def init_db():
                 for plan in planes_default:
                     db.session.add(plan)
                 db.session.commit()
+                invalidate_planes_cache()
                 print("[OK] Planes por defecto creados")
         except Exception as e:
             print(f"[WARNING] Error creando planes: {e}")
         
+        try:
+            calentar_consultas()
+        except Exception as e:
+            print(f"[WARNING] No se pudo precalentar consultas: {e}")
+        
         print("[OK] Base de datos inicializada")
 
 
+def calentar_consultas():
+    """Ejecuta una vez las consultas de los endpoints más usados para que el primer request
+    no pague la configuración de mappers ni la compilación de SQL (caché de sentencias de SQLAlchemy).
+    LIMIT es un parámetro enlazado, así que la sentencia compilada se reutiliza con cualquier límite."""
+    from sqlalchemy import select
+    from sqlalchemy.orm import configure_mappers
+    configure_mappers()
+    db.session.execute(
+        select(*[getattr(Cliente, c) for c in CLIENTE_API_COLS]).order_by(Cliente.fecha_registro.desc()).limit(0)
+    ).all()
+    _pagos_api(limit=1)
+    db.session.execute(
+        select(Pago.mes_correspondiente)
+        .where(Pago.mes_correspondiente.isnot(None), Pago.mes_correspondiente != '')
+        .distinct()
+        .order_by(Pago.mes_correspondiente.desc())
+    ).scalars().all()
+    AuditLog.query.order_by(AuditLog.fecha.desc()).limit(0).all()
+    get_planes_cached()
+    db.session.rollback()
+
+
 # ============== API DASHBOARD CHARTS ==============
 
 @app.route('/api/dashboard/charts')
 @login_required
 def dashboard_charts():
     """Datos para las gráficas del dashboard"""
+    return json_response(cache_dashboard('charts', _calcular_dashboard_charts))
+
+
+def _calcular_dashboard_charts():
+    """Datos de las gráficas (sin serializar, para la caché)"""
     from sqlalchemy import func, extract
     
     hoy = datetime.now()
     
+    # Últimos 6 meses calendario como (anio, mes); una consulta agrupada por serie en vez de 6
+    meses = [sumar_meses(hoy.year, hoy.month, -i) for i in range(5, -1, -1)]
+    desde = datetime(meses[0][0], meses[0][1], 1)
+    
+    def totales_por_mes(columna, agregado):
+        anio = extract('year', columna)
+        mes = extract('month', columna)
+        filas = db.session.query(anio, mes, agregado).filter(
+            columna >= desde
+        ).group_by(anio, mes).all()
+        return {(int(a), int(m)): total for a, m, total in filas}
+    
     # Ingresos últimos 6 meses
+    ingresos = totales_por_mes(Pago.fecha_pago, func.sum(Pago.monto))
     ingresos_mensuales = []
-    for i in range(5, -1, -1):
-        fecha = hoy - timedelta(days=30*i)
-        mes = fecha.month
-        anio = fecha.year
-        total = db.session.query(func.coalesce(func.sum(Pago.monto), 0)).filter(
-            extract('month', Pago.fecha_pago) == mes,
-            extract('year', Pago.fecha_pago) == anio
-        ).scalar()
-        nombre_mes = ['Ene','Feb','Mar','Abr','May','Jun','Jul','Ago','Sep','Oct','Nov','Dic'][mes-1]
-        ingresos_mensuales.append({'mes': f'{nombre_mes} {anio}', 'total': float(total)})
+    for anio, mes in meses:
+        ingresos_mensuales.append({'mes': f'{MESES_CORTOS[mes]} {anio}', 'total': float(ingresos.get((anio, mes)) or 0)})
     
     # Distribución por plan
     planes_dist = db.session.query(
@@ -4822,25 +5305,18 @@ def dashboard_charts():
     ).group_by(Cliente.estado).all()
     
     # Clientes nuevos por mes (últimos 6 meses)
+    registros = totales_por_mes(Cliente.fecha_registro, func.count(Cliente.id))
     clientes_nuevos = []
-    for i in range(5, -1, -1):
-        fecha = hoy - timedelta(days=30*i)
-        mes = fecha.month
-        anio = fecha.year
-        total = db.session.query(func.count(Cliente.id)).filter(
-            extract('month', Cliente.fecha_registro) == mes,
-            extract('year', Cliente.fecha_registro) == anio
-        ).scalar()
-        nombre_mes = ['Ene','Feb','Mar','Abr','May','Jun','Jul','Ago','Sep','Oct','Nov','Dic'][mes-1]
-        clientes_nuevos.append({'mes': f'{nombre_mes} {anio}', 'total': int(total)})
+    for anio, mes in meses:
+        clientes_nuevos.append({'mes': f'{MESES_CORTOS[mes]} {anio}', 'total': int(registros.get((anio, mes), 0))})
     
-    return jsonify({
+    return {
         'success': True,
         'ingresos_mensuales': ingresos_mensuales,
         'planes_distribucion': [{'plan': p[0], 'cantidad': p[1]} for p in planes_dist],
         'estados_distribucion': [{'estado': e[0], 'cantidad': e[1]} for e in estados],
         'clientes_nuevos': clientes_nuevos
-    })
+    }
 
 
 # ============== AUDIT LOG ==============
@@ -4859,8 +5335,28 @@ def actividad_view():
 def api_actividad():
     """API para obtener registros de auditoría"""
     limit = request.args.get('limit', 100, type=int)
-    logs = AuditLog.query.order_by(AuditLog.fecha.desc()).limit(limit).all()
-    return jsonify({'success': True, 'logs': [l.to_dict() for l in logs]})
+    return json_response({'success': True, 'logs': _auditoria_api(limit)})
+
+
+AUDIT_API_COLS = ('id', 'usuario', 'accion', 'entidad', 'entidad_id', 'detalle', 'ip_origen', 'fecha')
+
+
+def _auditoria_api(limit=None):
+    """Registros de auditoría como dicts (mismo formato que AuditLog.to_dict), más recientes primero"""
+    return list(_iter_auditoria_api(limit=limit))
+
+
+def _iter_auditoria_api(limit=None, yield_per=None):
+    """Igual que _auditoria_api() pero fila por fila (con yield_per se leen de la BD por bloques)"""
+    query = db.session.query(*[getattr(AuditLog, c) for c in AUDIT_API_COLS]).order_by(AuditLog.fecha.desc())
+    if limit:
+        query = query.limit(limit)
+    if yield_per:
+        query = query.yield_per(yield_per)
+    for r in query:
+        l = dict(zip(AUDIT_API_COLS, r))
+        l['fecha'] = _fmt_dts(l['fecha'])
+        yield l
 
 
 # ============== MAPA DE CLIENTES ==============
@@ -4872,27 +5368,23 @@ def mapa_view():
     return render_template('mapa.html')
 
 
+MAPA_COLS = ('id', 'nombre', 'ip_address', 'plan', 'estado', 'latitud', 'longitud', 'telefono', 'direccion')
+
+
 @app.route('/api/clientes/mapa')
 @login_required
 def api_clientes_mapa():
     """Obtener clientes con coordenadas para el mapa"""
-    clientes = Cliente.query.filter(
-        Cliente.latitud.isnot(None),
-        Cliente.longitud.isnot(None)
+    # Solo las columnas del mapa, como tuplas (sin objetos ORM)
+    rows = db.session.execute(
+        db.select(*[getattr(Cliente, c) for c in MAPA_COLS]).where(
+            Cliente.latitud.isnot(None),
+            Cliente.longitud.isnot(None)
+        ).order_by(Cliente.id)
     ).all()
-    return jsonify({
+    return json_response({
         'success': True,
-        'clientes': [{
-            'id': c.id,
-            'nombre': c.nombre,
-            'ip_address': c.ip_address,
-            'plan': c.plan,
-            'estado': c.estado,
-            'latitud': c.latitud,
-            'longitud': c.longitud,
-            'telefono': c.telefono,
-            'direccion': c.direccion
-        } for c in clientes]
+        'clientes': [dict(zip(MAPA_COLS, r)) for r in rows]
     })
 
 
@@ -4922,6 +5414,12 @@ def monitor_view():
     return render_template('monitor.html')
 
 
+def _par_enteros(valor):
+    """'upload/download' de MikroTik → (int, int); 0 en la parte que no sea un número"""
+    a, _, b = (valor or '').partition('/')
+    return (int(a) if a.isdigit() else 0), (int(b) if b.isdigit() else 0)
+
+
 @app.route('/api/monitor/bandwidth')
 @login_required
 def api_bandwidth():
@@ -4937,18 +5435,12 @@ def api_bandwidth():
         
         result = []
         for q in queues:
-            # MikroTik devuelve bytes como "upload/download"
-            rate = q.get('rate', '0/0').split('/')
-            bytes_data = q.get('bytes', '0/0').split('/')
-            
-            upload_rate = int(rate[0]) if len(rate) > 0 and rate[0].isdigit() else 0
-            download_rate = int(rate[1]) if len(rate) > 1 and rate[1].isdigit() else 0
-            upload_bytes = int(bytes_data[0]) if len(bytes_data) > 0 and bytes_data[0].isdigit() else 0
-            download_bytes = int(bytes_data[1]) if len(bytes_data) > 1 and bytes_data[1].isdigit() else 0
+            # MikroTik devuelve rate y bytes como "upload/download"
+            upload_rate, download_rate = _par_enteros(q.get('rate'))
+            upload_bytes, download_bytes = _par_enteros(q.get('bytes'))
             
-            max_limit = q.get('max-limit', '0/0').split('/')
-            max_upload = max_limit[0] if len(max_limit) > 0 else '0'
-            max_download = max_limit[1] if len(max_limit) > 1 else '0'
+            max_limit = q.get('max-limit', '0/0')
+            max_upload, _, max_download = max_limit.partition('/')
             
             result.append({
                 'name': q.get('name', ''),
@@ -4958,13 +5450,13 @@ def api_bandwidth():
                 'download_rate': download_rate,
                 'upload_bytes': upload_bytes,
                 'download_bytes': download_bytes,
-                'max_limit': q.get('max-limit', '0/0'),
+                'max_limit': max_limit,
                 'max_upload': max_upload,
-                'max_download': max_download,
+                'max_download': max_download or '0',
                 'comment': q.get('comment', '')
             })
         
-        return jsonify({'success': True, 'queues': result})
+        return json_response({'success': True, 'queues': result})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
@@ -5042,6 +5534,84 @@ def api_monitor_noc():
 
 # ============== BACKUP ==============
 
+def _filas_dict(modelo, columnas):
+    """Filas de un modelo como dicts con solo esas columnas (tuplas, sin objetos ORM)"""
+    query = db.session.query(*[getattr(modelo, c) for c in columnas])
+    return [dict(zip(columnas, r)) for r in query]
+
+
+BACKUP_CHUNK_SIZE = 1024 * 1024  # Bytes leídos de la base por bloque al armar el ZIP
+# Deflate nivel 1: varias veces más rápido que el nivel 6 por defecto y el ZIP sigue siendo estándar
+BACKUP_COMPRESSLEVEL = 1
+BACKUP_MIN_COMPRIMIR = 1024  # Bytes; por debajo, deflate apenas reduce (o agranda) el miembro
+
+
+BACKUP_YIELD_PER = 500  # Filas leídas de la BD por bloque al escribir clientes, pagos y auditoría
+
+
+class _SalidaZip:
+    """Destino de escritura para ZipFile que acumula los bytes hasta que se entregan"""
+    
+    def __init__(self):
+        self.partes = []
+        self.tamano = 0
+    
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        self.tamano += len(datos)
+        return len(datos)
+    
+    def flush(self):
+        pass
+    
+    def vaciar(self):
+        datos = b''.join(self.partes)
+        self.partes.clear()
+        self.tamano = 0
+        return datos
+
+
+def miembro_zip(nombre, date_time, compress_type=zipfile.ZIP_DEFLATED):
+    """ZipInfo con una fecha dada (la del backup) para no llamar a localtime() en cada miembro"""
+    info = zipfile.ZipInfo(nombre, date_time=date_time)
+    info.compress_type = compress_type
+    # ZipFile.open() con un ZipInfo toma el nivel del propio ZipInfo (Python 3.13 renombró el atributo)
+    if hasattr(info, 'compress_level'):
+        info.compress_level = BACKUP_COMPRESSLEVEL
+    else:
+        info._compresslevel = BACKUP_COMPRESSLEVEL
+    info.external_attr = 0o600 << 16  # los mismos permisos que pone writestr() con un nombre
+    return info
+
+
+def partes_json_array(filas):
+    """Arreglo JSON en bytes, un elemento a la vez (para escribirlo sin tener la lista en memoria)"""
+    yield b'['
+    separador = b'\n'
+    for fila in filas:
+        yield separador
+        yield json_archivo(fila)
+        separador = b',\n'
+    yield b'\n]'
+
+
+def instantanea_sqlite(db_path):
+    """Copia consistente y compacta (VACUUM INTO) de la base SQLite en un archivo temporal; quien llama la borra"""
+    fd, destino = tempfile.mkstemp(prefix='cuzonet_snap_', suffix='.db')
+    os.close(fd)
+    try:
+        # Conexión propia en autocommit: VACUUM no puede correr dentro de una transacción
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            conn.execute('VACUUM INTO ?', (destino,))
+        finally:
+            conn.close()
+    except Exception:
+        os.unlink(destino)
+        raise
+    return destino
+
+
 @app.route('/api/backup', methods=['GET'])
 @login_required
 def descargar_backup():
@@ -5068,94 +5638,123 @@ def descargar_backup():
 @login_required
 def descargar_backup_completo():
     """Descargar backup completo de TODOS los datos en formato ZIP con JSONs"""
+    snap = None
     try:
-        fecha = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # ---- Clientes ----
-        clientes = Cliente.query.all()
-        clientes_data = [c.to_dict() for c in clientes]
-        
-        # ---- Pagos ----
-        pagos = Pago.query.all()
-        pagos_data = [p.to_dict() for p in pagos]
+        ahora = datetime.now()
+        fecha = ahora.strftime('%Y%m%d_%H%M%S')
+        # Todos los miembros llevan la misma fecha: la del backup
+        sello = ahora.timetuple()[:6]
         
         # ---- Planes ----
-        planes = Plan.query.all()
-        planes_data = [{
-            'id': p.id,
-            'nombre': p.nombre,
-            'velocidad_download': p.velocidad_download,
-            'velocidad_upload': p.velocidad_upload,
-            'precio': p.precio,
-            'descripcion': p.descripcion
-        } for p in planes]
+        planes_data = _filas_dict(Plan, ('id', 'nombre', 'velocidad_download', 'velocidad_upload', 'precio', 'descripcion'))
         
         # ---- Configuración MikroTik ----
-        configs = ConfigMikroTik.query.all()
-        configs_data = [{
-            'id': c.id,
-            'nombre': c.nombre,
-            'host': c.host,
-            'port': c.port,
-            'username': c.username,
-            'use_ssl': c.use_ssl,
-            'address_list_cortados': c.address_list_cortados
-        } for c in configs]
-        
-        # ---- Registro de Actividad ----
-        logs = AuditLog.query.order_by(AuditLog.fecha.desc()).all()
-        logs_data = [l.to_dict() for l in logs]
+        configs_data = _filas_dict(ConfigMikroTik, ('id', 'nombre', 'host', 'port', 'username', 'use_ssl', 'address_list_cortados'))
         
         # ---- Usuarios (sin contraseñas) ----
-        usuarios = Usuario.query.all()
-        usuarios_data = [{
-            'id': u.id,
-            'username': u.username,
-            'nombre': u.nombre,
-            'rol': u.rol,
-            'activo': u.activo,
-            'fecha_creacion': u.fecha_creacion.strftime('%Y-%m-%d %H:%M') if u.fecha_creacion else None
-        } for u in usuarios]
-        
-        # ---- Resumen general ----
-        resumen = {
-            'fecha_backup': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'total_clientes': len(clientes_data),
-            'total_pagos': len(pagos_data),
-            'total_planes': len(planes_data),
-            'total_usuarios': len(usuarios_data),
-            'total_registros_actividad': len(logs_data),
-            'clientes_activos': len([c for c in clientes_data if c.get('estado') == 'activo']),
-            'clientes_suspendidos': len([c for c in clientes_data if c.get('estado') == 'suspendido']),
-            'clientes_cortados': len([c for c in clientes_data if c.get('estado') == 'cortado']),
-        }
-        
-        # Crear ZIP en memoria
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr('resumen_backup.json', json.dumps(resumen, indent=2, ensure_ascii=False))
-            zf.writestr('clientes.json', json.dumps(clientes_data, indent=2, ensure_ascii=False))
-            zf.writestr('pagos.json', json.dumps(pagos_data, indent=2, ensure_ascii=False))
-            zf.writestr('planes.json', json.dumps(planes_data, indent=2, ensure_ascii=False))
-            zf.writestr('configuracion_mikrotik.json', json.dumps(configs_data, indent=2, ensure_ascii=False))
-            zf.writestr('registro_actividad.json', json.dumps(logs_data, indent=2, ensure_ascii=False))
-            zf.writestr('usuarios.json', json.dumps(usuarios_data, indent=2, ensure_ascii=False))
+        usuarios_data = _filas_dict(Usuario, ('id', 'username', 'nombre', 'rol', 'activo', 'fecha_creacion'))
+        for u in usuarios_data:
+            u['fecha_creacion'] = _fmt_dt(u['fecha_creacion'])
+        
+        miembros = [
+            ('planes.json', planes_data),
+            ('configuracion_mikrotik.json', configs_data),
+            ('usuarios.json', usuarios_data),
+        ]
+        # También incluir la base de datos SQLite si existe. La instantánea se toma antes de
+        # responder: si falla, el cliente recibe un 500 y no un ZIP truncado con estado 200
+        db_path = os.path.join(app.instance_path, 'clientes.db')
+        if os.path.exists(db_path):
+            snap = instantanea_sqlite(db_path)
+        
+        def limpiar_instantanea():
+            if snap and os.path.exists(snap):
+                os.unlink(snap)
+        
+        def generar():
+            # El ZIP se escribe a un destino no posicionable y se entrega por partes (sin buffer completo)
+            salida = _SalidaZip()
+            por_estado = {}
+            total_pagos = 0
+            total_logs = 0
+            
+            def clientes():
+                for c in _iter_clientes_api(yield_per=BACKUP_YIELD_PER):
+                    por_estado[c['estado']] = por_estado.get(c['estado'], 0) + 1
+                    yield c
+            
+            def pagos():
+                nonlocal total_pagos
+                for p in _iter_pagos_api(yield_per=BACKUP_YIELD_PER):
+                    total_pagos += 1
+                    yield p
+            
+            def registro():
+                nonlocal total_logs
+                for l in _iter_auditoria_api(yield_per=BACKUP_YIELD_PER):
+                    total_logs += 1
+                    yield l
             
-            # También incluir la base de datos SQLite si existe
-            db_path = os.path.join(app.instance_path, 'clientes.db')
-            if os.path.exists(db_path):
-                zf.write(db_path, 'clientes.db')
+            with zipfile.ZipFile(salida, 'w', zipfile.ZIP_DEFLATED, compresslevel=BACKUP_COMPRESSLEVEL) as zf:
+                # ---- Clientes, pagos y registro de actividad: fila por fila, sin armar la lista completa ----
+                for nombre, filas in (('clientes.json', clientes()), ('pagos.json', pagos()),
+                                      ('registro_actividad.json', registro())):
+                    with zf.open(miembro_zip(nombre, sello), 'w', force_zip64=True) as destino:
+                        for parte in partes_json_array(filas):
+                            destino.write(parte)
+                            if salida.tamano >= BACKUP_CHUNK_SIZE:
+                                yield salida.vaciar()
+                    yield salida.vaciar()
+                
+                # ---- Resumen general (al final: usa los conteos del recorrido) ----
+                resumen = {
+                    'fecha_backup': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'total_clientes': sum(por_estado.values()),
+                    'total_pagos': total_pagos,
+                    'total_planes': len(planes_data),
+                    'total_usuarios': len(usuarios_data),
+                    'total_registros_actividad': total_logs,
+                    'clientes_activos': por_estado.get('activo', 0),
+                    'clientes_suspendidos': por_estado.get('suspendido', 0),
+                    'clientes_cortados': por_estado.get('cortado', 0),
+                }
+                
+                for nombre, datos in [('resumen_backup.json', resumen)] + miembros:
+                    contenido = json_archivo(datos)
+                    # Los JSON pequeños (resumen, configuración) se guardan sin comprimir
+                    tipo = zipfile.ZIP_STORED if len(contenido) < BACKUP_MIN_COMPRIMIR else zipfile.ZIP_DEFLATED
+                    zf.writestr(miembro_zip(nombre, sello, tipo), contenido, compresslevel=BACKUP_COMPRESSLEVEL)
+                    yield salida.vaciar()
+                if snap:
+                    zip64 = os.path.getsize(snap) > zipfile.ZIP64_LIMIT
+                    with open(snap, 'rb') as origen, zf.open(miembro_zip('clientes.db', sello), 'w', force_zip64=zip64) as destino:
+                        for bloque in iter(lambda: origen.read(BACKUP_CHUNK_SIZE), b''):
+                            destino.write(bloque)
+                            yield salida.vaciar()
+            yield salida.vaciar()
+        
+        def generar_con_registro():
+            # El estado 200 ya se envió: un error a mitad del ZIP solo puede quedar en el log
+            try:
+                yield from generar()
+            except Exception:
+                app.logger.exception('[BACKUP] Error generando el ZIP completo')
+                raise
+            finally:
+                limpiar_instantanea()
         
-        zip_buffer.seek(0)
         nombre_archivo = f'cuzonet_backup_completo_{fecha}.zip'
-        
-        return send_file(
-            zip_buffer,
-            as_attachment=True,
-            download_name=nombre_archivo,
-            mimetype='application/zip'
+        respuesta = Response(
+            stream_with_context(generar_con_registro()),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename={nombre_archivo}'}
         )
+        # Si el cliente corta antes de la primera parte, el finally del generador no corre
+        respuesta.call_on_close(limpiar_instantanea)
+        return respuesta
     except Exception as e:
+        if snap and os.path.exists(snap):
+            os.unlink(snap)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -5164,11 +5763,15 @@ def descargar_backup_completo():
 def backup_info():
     """Obtener información de lo que incluiría el backup"""
     try:
-        total_clientes = Cliente.query.count()
-        total_pagos = Pago.query.count()
-        total_planes = Plan.query.count()
-        total_logs = AuditLog.query.count()
-        total_usuarios = Usuario.query.count()
+        from sqlalchemy import func
+        
+        # Los cinco conteos como subconsultas escalares de un solo SELECT (un round-trip)
+        def contar(modelo):
+            return db.select(func.count()).select_from(modelo).scalar_subquery()
+        
+        total_clientes, total_pagos, total_planes, total_logs, total_usuarios = db.session.execute(
+            db.select(contar(Cliente), contar(Pago), contar(Plan), contar(AuditLog), contar(Usuario))
+        ).one()
         
         return jsonify({
             'success': True,
@@ -5189,6 +5792,8 @@ def backup_info():
 def restaurar_backup():
     """Restaurar datos desde un archivo ZIP de backup completo"""
     try:
+        from sqlalchemy import insert, update
+        
         if 'archivo' not in request.files:
             return jsonify({'success': False, 'error': 'No se envió ningún archivo'}), 400
         
@@ -5199,13 +5804,15 @@ def restaurar_backup():
         if not archivo.filename.lower().endswith('.zip'):
             return jsonify({'success': False, 'error': 'El archivo debe ser un ZIP de backup (.zip)'}), 400
         
-        # Leer el ZIP en memoria
-        zip_data = BytesIO(archivo.read())
+        # Werkzeug ya guarda la subida en un temporal (en disco si supera 500 KB); ZipFile lo lee sin copiarlo a memoria
+        zip_data = archivo.stream
         
         if not zipfile.is_zipfile(zip_data):
             return jsonify({'success': False, 'error': 'El archivo no es un ZIP válido'}), 400
         
         zip_data.seek(0)
+        # Usuario que restaura: se resuelve una vez, antes de tocar la sesión
+        actor = current_user.username if current_user.is_authenticated else 'sistema'
         resultados = {
             'clientes_importados': 0,
             'pagos_importados': 0,
@@ -5214,75 +5821,84 @@ def restaurar_backup():
             'errores': []
         }
         
+        # Sin BEGIN explícito, en SQLite cada savepoint de abajo se confirmaría por separado
+        abrir_transaccion_sqlite(db.session.connection())
+        
+        # Cada sección va en un savepoint (un error revierte solo esa sección); commit único al final
         with zipfile.ZipFile(zip_data, 'r') as zf:
             archivos_en_zip = zf.namelist()
             
             # ---- Restaurar Planes ----
             if 'planes.json' in archivos_en_zip:
                 try:
-                    planes_data = json.loads(zf.read('planes.json').decode('utf-8'))
-                    for p in planes_data:
-                        existente = Plan.query.filter_by(nombre=p['nombre']).first()
-                        if not existente:
-                            nuevo = Plan(
-                                nombre=p['nombre'],
+                    with db.session.begin_nested():
+                        planes_data = leer_json(zf.read('planes.json'))
+                        # Planes existentes por nombre (una consulta) → filas a insertar / actualizar en bloque
+                        ids_planes = dict(db.session.query(Plan.nombre, Plan.id).all())
+                        nuevos_planes = {}
+                        planes_actualizar = {}
+                        for p in planes_data:
+                            valores = dict(
                                 velocidad_download=p['velocidad_download'],
                                 velocidad_upload=p['velocidad_upload'],
                                 precio=p.get('precio', 0),
                                 descripcion=p.get('descripcion', '')
                             )
-                            db.session.add(nuevo)
-                            resultados['planes_importados'] += 1
-                        else:
-                            existente.velocidad_download = p['velocidad_download']
-                            existente.velocidad_upload = p['velocidad_upload']
-                            existente.precio = p.get('precio', 0)
-                            existente.descripcion = p.get('descripcion', '')
+                            if p['nombre'] in ids_planes:
+                                planes_actualizar[p['nombre']] = dict(valores, id=ids_planes[p['nombre']])
+                            elif p['nombre'] in nuevos_planes:
+                                # Repetido en el mismo backup: gana la última aparición
+                                nuevos_planes[p['nombre']].update(valores)
+                            else:
+                                nuevos_planes[p['nombre']] = dict(valores, nombre=p['nombre'])
                             resultados['planes_importados'] += 1
-                    db.session.commit()
+                        if nuevos_planes:
+                            db.session.execute(insert(Plan), list(nuevos_planes.values()))
+                        if planes_actualizar:
+                            db.session.execute(update(Plan), list(planes_actualizar.values()))
                 except Exception as e:
-                    db.session.rollback()
                     resultados['errores'].append(f'Error en planes: {str(e)}')
             
             # ---- Restaurar Configuración MikroTik ----
             if 'configuracion_mikrotik.json' in archivos_en_zip:
                 try:
-                    configs_data = json.loads(zf.read('configuracion_mikrotik.json').decode('utf-8'))
-                    for c in configs_data:
-                        existente = ConfigMikroTik.query.first()
-                        if existente:
-                            existente.host = c.get('host', '')
-                            existente.port = c.get('port', 80)
-                            existente.username = c.get('username', '')
-                            existente.use_ssl = c.get('use_ssl', False)
-                            existente.address_list_cortados = c.get('address_list_cortados', 'MOROSOS')
-                        else:
-                            nueva = ConfigMikroTik(
-                                nombre=c.get('nombre', 'Principal'),
-                                host=c.get('host', ''),
-                                port=c.get('port', 80),
-                                username=c.get('username', ''),
-                                password='',
-                                use_ssl=c.get('use_ssl', False),
-                                address_list_cortados=c.get('address_list_cortados', 'MOROSOS')
-                            )
-                            db.session.add(nueva)
-                        resultados['config_importada'] = True
-                    db.session.commit()
+                    with db.session.begin_nested():
+                        configs_data = leer_json(zf.read('configuracion_mikrotik.json'))
+                        for c in configs_data:
+                            existente = ConfigMikroTik.query.first()
+                            if existente:
+                                existente.host = c.get('host', '')
+                                existente.port = c.get('port', 80)
+                                existente.username = c.get('username', '')
+                                existente.use_ssl = c.get('use_ssl', False)
+                                existente.address_list_cortados = c.get('address_list_cortados', 'MOROSOS')
+                            else:
+                                nueva = ConfigMikroTik(
+                                    nombre=c.get('nombre', 'Principal'),
+                                    host=c.get('host', ''),
+                                    port=c.get('port', 80),
+                                    username=c.get('username', ''),
+                                    password='',
+                                    use_ssl=c.get('use_ssl', False),
+                                    address_list_cortados=c.get('address_list_cortados', 'MOROSOS')
+                                )
+                                db.session.add(nueva)
+                            resultados['config_importada'] = True
                 except Exception as e:
-                    db.session.rollback()
                     resultados['errores'].append(f'Error en config: {str(e)}')
             
             # ---- Restaurar Clientes ----
             if 'clientes.json' in archivos_en_zip:
                 try:
-                    clientes_data = json.loads(zf.read('clientes.json').decode('utf-8'))
-                    for c in clientes_data:
-                        existente = Cliente.query.filter_by(ip_address=c['ip_address']).first()
-                        if not existente:
-                            nuevo = Cliente(
+                    with db.session.begin_nested():
+                        clientes_data = leer_json(zf.read('clientes.json'))
+                        # Clientes existentes por IP (una consulta) → filas a insertar / actualizar en bloque
+                        ids_clientes = dict(db.session.query(Cliente.ip_address, Cliente.id).all())
+                        nuevos = {}
+                        actualizar = {}
+                        for c in clientes_data:
+                            valores = dict(
                                 nombre=c['nombre'],
-                                ip_address=c['ip_address'],
                                 plan=c['plan'],
                                 velocidad_download=c['velocidad_download'],
                                 velocidad_upload=c['velocidad_upload'],
@@ -5291,118 +5907,128 @@ def restaurar_backup():
                                 direccion=c.get('direccion', ''),
                                 cedula=c.get('cedula', ''),
                                 estado=c.get('estado', 'activo'),
-                                queue_name=c.get('queue_name', ''),
-                                mikrotik_id=c.get('mikrotik_id', ''),
                                 dia_corte=c.get('dia_corte', 1),
                                 precio_mensual=c.get('precio_mensual', 0),
                                 saldo_pendiente=c.get('saldo_pendiente', 0),
                                 latitud=c.get('latitud'),
                                 longitud=c.get('longitud')
                             )
-                            if c.get('fecha_ultimo_pago'):
-                                try:
-                                    nuevo.fecha_ultimo_pago = datetime.strptime(c['fecha_ultimo_pago'], '%Y-%m-%d')
-                                except:
-                                    pass
-                            if c.get('fecha_proximo_pago'):
-                                try:
-                                    nuevo.fecha_proximo_pago = datetime.strptime(c['fecha_proximo_pago'], '%Y-%m-%d')
-                                except:
-                                    pass
-                            db.session.add(nuevo)
-                            resultados['clientes_importados'] += 1
-                        else:
-                            # Actualizar datos del cliente existente
-                            existente.nombre = c['nombre']
-                            existente.plan = c['plan']
-                            existente.velocidad_download = c['velocidad_download']
-                            existente.velocidad_upload = c['velocidad_upload']
-                            existente.telefono = c.get('telefono', '')
-                            existente.email = c.get('email', '')
-                            existente.direccion = c.get('direccion', '')
-                            existente.cedula = c.get('cedula', '')
-                            existente.estado = c.get('estado', 'activo')
-                            existente.dia_corte = c.get('dia_corte', 1)
-                            existente.precio_mensual = c.get('precio_mensual', 0)
-                            existente.saldo_pendiente = c.get('saldo_pendiente', 0)
-                            existente.latitud = c.get('latitud')
-                            existente.longitud = c.get('longitud')
+                            ip = c['ip_address']
+                            if ip in ids_clientes:
+                                # Actualizar datos del cliente existente
+                                actualizar[ip] = dict(valores, id=ids_clientes[ip])
+                            elif ip in nuevos:
+                                # IP repetida en el mismo backup: se actualiza la fila pendiente
+                                nuevos[ip].update(valores)
+                            else:
+                                nuevo = dict(
+                                    valores,
+                                    ip_address=ip,
+                                    queue_name=c.get('queue_name', ''),
+                                    mikrotik_id=c.get('mikrotik_id', '')
+                                )
+                                if c.get('fecha_ultimo_pago'):
+                                    try:
+                                        nuevo['fecha_ultimo_pago'] = datetime.fromisoformat(c['fecha_ultimo_pago'])
+                                    except:
+                                        pass
+                                if c.get('fecha_proximo_pago'):
+                                    try:
+                                        nuevo['fecha_proximo_pago'] = datetime.fromisoformat(c['fecha_proximo_pago'])
+                                    except:
+                                        pass
+                                nuevos[ip] = nuevo
                             resultados['clientes_importados'] += 1
-                    db.session.commit()
+                        if nuevos:
+                            db.session.execute(insert(Cliente), list(nuevos.values()))
+                        if actualizar:
+                            db.session.execute(update(Cliente), list(actualizar.values()))
                 except Exception as e:
-                    db.session.rollback()
                     resultados['errores'].append(f'Error en clientes: {str(e)}')
             
             # ---- Restaurar Pagos ----
             if 'pagos.json' in archivos_en_zip:
                 try:
-                    pagos_data = json.loads(zf.read('pagos.json').decode('utf-8'))
-                    for p in pagos_data:
-                        # Buscar cliente por nombre
-                        cliente = None
-                        if p.get('cliente_nombre'):
-                            cliente = Cliente.query.filter_by(nombre=p['cliente_nombre']).first()
-                        if not cliente and p.get('cliente_id'):
-                            cliente = Cliente.query.get(p['cliente_id'])
+                    with db.session.begin_nested():
+                        pagos_data = leer_json(zf.read('pagos.json'))
+                        # Clientes por nombre e id en una sola consulta (el primero gana si el nombre se repite)
+                        clientes_por_nombre = {}
+                        ids_existentes = set()
+                        for cid, nombre in db.session.query(Cliente.id, Cliente.nombre).order_by(Cliente.id):
+                            clientes_por_nombre.setdefault(nombre, cid)
+                            ids_existentes.add(cid)
+                        # Pagos ya registrados como (cliente, monto, mes, día) para detectar duplicados sin consultar por fila
+                        pagos_registrados = {
+                            (cid, monto, mes, fecha.date())
+                            for cid, monto, mes, fecha in db.session.query(
+                                Pago.cliente_id, Pago.monto, Pago.mes_correspondiente, Pago.fecha_pago
+                            ) if fecha
+                        }
+                        nuevos_pagos = []
+                        for p in pagos_data:
+                            # Buscar cliente por nombre
+                            cliente_id = None
+                            if p.get('cliente_nombre'):
+                                cliente_id = clientes_por_nombre.get(p['cliente_nombre'])
+                            if not cliente_id and p.get('cliente_id') in ids_existentes:
+                                cliente_id = p['cliente_id']
                         
-                        if cliente:
-                            # Verificar si el pago ya existe (por fecha y monto y cliente)
-                            fecha_pago = None
-                            if p.get('fecha_pago'):
-                                try:
-                                    fecha_pago = datetime.strptime(p['fecha_pago'], '%Y-%m-%d %H:%M')
-                                except:
+                            if cliente_id:
+                                # Verificar si el pago ya existe (por fecha y monto y cliente)
+                                fecha_pago = None
+                                if p.get('fecha_pago'):
+                                    # fromisoformat acepta 'YYYY-MM-DD HH:MM' y 'YYYY-MM-DD' en una sola pasada
                                     try:
-                                        fecha_pago = datetime.strptime(p['fecha_pago'], '%Y-%m-%d')
+                                        fecha_pago = datetime.fromisoformat(p['fecha_pago'])
                                     except:
                                         fecha_pago = datetime.utcnow()
                             
-                            pago_existente = None
-                            if fecha_pago:
-                                pago_existente = Pago.query.filter_by(
-                                    cliente_id=cliente.id,
-                                    monto=p['monto'],
-                                    mes_correspondiente=p.get('mes_correspondiente', '')
-                                ).filter(
-                                    db.func.date(Pago.fecha_pago) == fecha_pago.date()
-                                ).first()
+                                mes = p.get('mes_correspondiente', '')
+                                if fecha_pago:
+                                    clave = (cliente_id, p['monto'], mes, fecha_pago.date())
+                                    if clave in pagos_registrados:
+                                        continue
+                                    pagos_registrados.add(clave)
                             
-                            if not pago_existente:
-                                nuevo_pago = Pago(
-                                    cliente_id=cliente.id,
+                                nuevos_pagos.append(dict(
+                                    cliente_id=cliente_id,
                                     monto=p['monto'],
                                     fecha_pago=fecha_pago or datetime.utcnow(),
-                                    mes_correspondiente=p.get('mes_correspondiente', ''),
+                                    mes_correspondiente=mes,
                                     metodo_pago=p.get('metodo_pago', ''),
                                     referencia=p.get('referencia', ''),
                                     notas=p.get('notas', '')
-                                )
-                                db.session.add(nuevo_pago)
+                                ))
                                 resultados['pagos_importados'] += 1
-                    db.session.commit()
+                        if nuevos_pagos:
+                            db.session.execute(insert(Pago), nuevos_pagos)
                 except Exception as e:
-                    db.session.rollback()
                     resultados['errores'].append(f'Error en pagos: {str(e)}')
         
         # Registrar en auditoría
         try:
             log = AuditLog(
-                usuario=current_user.username if current_user.is_authenticated else 'sistema',
+                usuario=actor,
                 accion='restaurar_backup',
                 entidad='sistema',
                 detalle=f'Backup restaurado: {resultados["clientes_importados"]} clientes, {resultados["pagos_importados"]} pagos, {resultados["planes_importados"]} planes'
             )
             db.session.add(log)
-            db.session.commit()
         except:
             pass
         
+        # Una sola transacción para todo el restore: un único commit (un fsync en SQLite)
+        db.session.commit()
+        invalidate_planes_cache()
+        invalidate_dashboard_cache()
+        
         return jsonify({
             'success': True,
             'mensaje': 'Backup restaurado exitosamente',
             'resultados': resultados
         })
     except Exception as e:
+        db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -5413,9 +6039,9 @@ def restaurar_backup():
 def ficha_cliente(cliente_id):
     """Genera una ficha imprimible del cliente"""
     cliente = Cliente.query.get_or_404(cliente_id)
+    # Solo los últimos 12 pagos (usa ix_pago_cliente_fecha); la plantilla no usa la config del router
     pagos = Pago.query.filter_by(cliente_id=cliente_id).order_by(Pago.fecha_pago.desc()).limit(12).all()
-    config = ConfigMikroTik.query.first()
-    return render_template('ficha_cliente.html', cliente=cliente, pagos=pagos, config=config, now=datetime.now().strftime('%d/%m/%Y %H:%M'))
+    return render_template('ficha_cliente.html', cliente=cliente, pagos=pagos, now=datetime.now().strftime('%d/%m/%Y %H:%M'))
 
 
 # ============== WHATSAPP BOT MANAGEMENT ==============
@@ -5556,6 +6182,22 @@ def whatsapp_cambiar_numero():
 # Ejecutar migración al importar (para gunicorn) de forma asíncrona para no bloquear el health check
 import threading
 
+def inicializar_bd():
+    """init_db() más las migraciones sueltas de columnas. Los errores se propagan
+    (lo usa gunicorn.conf.py para saber si la inicialización falló)."""
+    init_db()
+    with app.app_context():
+        try:
+            db.create_all()
+            from sqlalchemy import text
+            db.session.execute(text('ALTER TABLE vouchers ADD COLUMN lote_id INTEGER REFERENCES lotes_fichas(id)'))
+            db.session.commit()
+            print("Migración: Columna lote_id agregada con éxito.")
+        except Exception as e:
+            db.session.rollback()
+    migrar_inventario_manual()
+
+
 def run_init_db_async():
     try:
         import fcntl as _fcntl
@@ -5565,39 +6207,23 @@ def run_init_db_async():
         _lock_fd = open(_lock_path, 'w')
         _fcntl.flock(_lock_fd, _fcntl.LOCK_EX)
         try:
-            init_db()
-            with app.app_context():
-                try:
-                    db.create_all()
-                    from sqlalchemy import text
-                    db.session.execute(text('ALTER TABLE vouchers ADD COLUMN lote_id INTEGER REFERENCES lotes_fichas(id)'))
-                    db.session.commit()
-                    print("Migración: Columna lote_id agregada con éxito.")
-                except Exception as e:
-                    db.session.rollback()
+            inicializar_bd()
         finally:
             _fcntl.flock(_lock_fd, _fcntl.LOCK_UN)
             _lock_fd.close()
     except (ImportError, OSError):
         try:
-            init_db()
-            with app.app_context():
-                try:
-                    db.create_all()
-                    from sqlalchemy import text
-                    db.session.execute(text('ALTER TABLE vouchers ADD COLUMN lote_id INTEGER REFERENCES lotes_fichas(id)'))
-                    db.session.commit()
-                    print("Migración: Columna lote_id agregada con éxito.")
-                except Exception as e:
-                    db.session.rollback()
+            inicializar_bd()
         except Exception as e:
             print(f"[WARNING] init_db falló: {e}")
     except Exception as e:
         print(f"[WARNING] run_init_db_async falló: {e}")
         print(f"[WARNING] init_db falló: {e}")
 
-# Arrancar la inicialización de base de datos de fondo
-threading.Thread(target=run_init_db_async, daemon=True).start()
+# Arrancar la inicialización de base de datos de fondo. Con gunicorn.conf.py la hace
+# una sola vez el proceso maestro (on_starting) y los workers llegan con CUZONET_INIT_DB=0
+if os.getenv('CUZONET_INIT_DB', '1') == '1':
+    threading.Thread(target=run_init_db_async, daemon=True).start()
 
 
 def vendedor_required(f):
@@ -5682,6 +6308,7 @@ def hotspot_router_guardar():
         flash('Router configurado como Hotspot', 'success')
         
     db.session.commit()
+    invalidate_mt_cache(router.id)
     registrar_auditoria('guardar_router_hotspot', 'config_mikrotik', router.id if 'router' in locals() else None, 'Router Hotspot guardado')
     return redirect(url_for('hotspot_admin'))
 
@@ -5994,7 +6621,7 @@ def hotspot_vouchers_grid():
     if selected_router_id:
         router = ConfigMikroTik.query.get(selected_router_id)
         if router:
-            api = MikroTikAPI(router.host, router.username, router.password, router.port, router.use_ssl)
+            api = api_para_router(router)
             success, result = api.get_hotspot_profiles_with_counts()
             if success:
                 profiles_data = result
@@ -6047,7 +6674,7 @@ def hotspot_mikhmon_users():
     if selected_router_id:
         router = ConfigMikroTik.query.get(selected_router_id)
         if router:
-            api = MikroTikAPI(router.host, router.username, router.password, router.port, router.use_ssl)
+            api = api_para_router(router)
             # Usar la base de datos local (Sincronizada) en lugar de la API en vivo
             query = HotspotUserSync.query.filter_by(router_id=router.id)
             
@@ -6109,7 +6736,7 @@ def hotspot_sync_users():
     if not router:
         return jsonify({'success': False, 'error': 'Router not found'})
         
-    api = MikroTikAPI(router.host, router.username, router.password, router.port, router.use_ssl)
+    api = api_para_router(router)
     
     success, result = api.get_hotspot_users(profile=None)
     
@@ -6161,7 +6788,7 @@ def hotspot_live_dashboard_api():
     if not router:
         return jsonify({'error': 'Router no encontrado'})
         
-    api = MikroTikAPI(router.host, router.username, router.password, router.port, router.use_ssl)
+    api = api_para_router(router)
     data = api.get_live_dashboard_data()
     
     return jsonify(data)
@@ -6231,7 +6858,7 @@ def api_hotspot_get_profiles():
     if not router:
         return jsonify({'error': 'Router no encontrado'}), 404
         
-    api = MikroTikAPI(router.host, router.username, router.password, router.port, router.use_ssl)
+    api = api_para_router(router)
     conectado, _ = api.test_connection()
     if not conectado:
         return jsonify({'error': 'No se pudo conectar al router'}), 500
@@ -6499,7 +7126,7 @@ def hotspot_generar_masivo():
         
     router = ConfigMikroTik.query.get_or_404(router_id)
     
-    api = MikroTikAPI(router.host, router.username, router.password, router.port, router.use_ssl)
+    api = api_para_router(router)
     conectado, msg = api.test_connection()
     if not conectado:
         flash(f'Error de conexión con el MikroTik {router.nombre}. Revisa las credenciales.', 'error')
@@ -6655,7 +7282,7 @@ def hotspot_generar_masivo_ajax():
             db.session.add(lote)
             db.session.commit()
     
-    api = MikroTikAPI(router.host, router.username, router.password, router.port, router.use_ssl)
+    api = api_para_router(router)
     conectado, msg = api.test_connection()
     if not conectado:
         return jsonify({'error': f'Error de conexión con MikroTik: {msg}'})
@@ -7016,19 +7643,29 @@ def vendedor_dashboard():
 
     # Calcular Métricas (Fase 2)
     hoy = datetime.utcnow().date()
-    mes_actual = hoy.month
-    año_actual = hoy.year
+    
+    # Rangos [inicio, fin) en vez de date()/extract() sobre la columna: así la
+    # comparación puede usar el índice de la fecha
+    def rango_del_dia(dia):
+        inicio = datetime(dia.year, dia.month, dia.day)
+        return inicio, inicio + timedelta(days=1)
+    
+    inicio_hoy, fin_hoy = rango_del_dia(hoy)
+    inicio_mes = datetime(hoy.year, hoy.month, 1)
+    fin_mes = datetime(*sumar_meses(hoy.year, hoy.month, 1), 1)
     
     # Fichas Mikrotik vendidas hoy
     fichas_hoy_mt = Voucher.query.filter(
         Voucher.vendedor_id == current_user.id,
-        db.func.date(Voucher.fecha_creacion) == hoy
+        Voucher.fecha_creacion >= inicio_hoy,
+        Voucher.fecha_creacion < fin_hoy
     ).all()
     
     # Fichas Omada vendidas hoy (estado usado/vencido)
     fichas_hoy_om = OmadaVoucher.query.filter(
         OmadaVoucher.vendedor_id == current_user.id,
-        db.func.date(OmadaVoucher.fecha_uso) == hoy,
+        OmadaVoucher.fecha_uso >= inicio_hoy,
+        OmadaVoucher.fecha_uso < fin_hoy,
         OmadaVoucher.estado.in_(['usado', 'vencido'])
     ).all()
     
@@ -7037,15 +7674,15 @@ def vendedor_dashboard():
     # Fichas Mikrotik vendidas este mes
     fichas_mes_mt = Voucher.query.filter(
         Voucher.vendedor_id == current_user.id,
-        db.func.extract('month', Voucher.fecha_creacion) == mes_actual,
-        db.func.extract('year', Voucher.fecha_creacion) == año_actual
+        Voucher.fecha_creacion >= inicio_mes,
+        Voucher.fecha_creacion < fin_mes
     ).all()
     
     # Fichas Omada vendidas este mes
     fichas_mes_om = OmadaVoucher.query.filter(
         OmadaVoucher.vendedor_id == current_user.id,
-        db.func.extract('month', OmadaVoucher.fecha_uso) == mes_actual,
-        db.func.extract('year', OmadaVoucher.fecha_uso) == año_actual,
+        OmadaVoucher.fecha_uso >= inicio_mes,
+        OmadaVoucher.fecha_uso < fin_mes,
         OmadaVoucher.estado.in_(['usado', 'vencido'])
     ).all()
     
@@ -7080,8 +7717,9 @@ def vendedor_dashboard():
         dia = hoy - timedelta(days=i)
         dias_grafico.append(dia.strftime('%d/%m'))
         
-        v_mt = Voucher.query.filter(Voucher.vendedor_id == current_user.id, db.func.date(Voucher.fecha_creacion) == dia).all()
-        v_om = OmadaVoucher.query.filter(OmadaVoucher.vendedor_id == current_user.id, db.func.date(OmadaVoucher.fecha_uso) == dia, OmadaVoucher.estado.in_(['usado', 'vencido'])).all()
+        inicio_dia, fin_dia = rango_del_dia(dia)
+        v_mt = Voucher.query.filter(Voucher.vendedor_id == current_user.id, Voucher.fecha_creacion >= inicio_dia, Voucher.fecha_creacion < fin_dia).all()
+        v_om = OmadaVoucher.query.filter(OmadaVoucher.vendedor_id == current_user.id, OmadaVoucher.fecha_uso >= inicio_dia, OmadaVoucher.fecha_uso < fin_dia, OmadaVoucher.estado.in_(['usado', 'vencido'])).all()
         
         total_dia = sum(v.precio for v in v_mt) + sum(o.precio for o in v_om)
         ventas_grafico.append(total_dia)
@@ -7402,8 +8040,8 @@ def iniciar_scheduler():
     except ImportError:
         print("ADVERTENCIA: APScheduler no está instalado. No se ejecutarán las alertas.")
 
-# Inicializar scheduler al cargar la app (para Gunicorn)
-try:
+def migrar_inventario_manual():
+    """Crea tablas faltantes y agrega las columnas nuevas de inventario_manual_lote"""
     with app.app_context():
         db.create_all()
         # Agregar nuevas columnas si no existen
@@ -7416,8 +8054,13 @@ try:
             db.session.rollback()
             print("Notice de DB (puede ser normal si las columnas ya existen):", e)
         print("Tablas de base de datos verificadas/creadas con éxito.")
-    
-    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or os.getenv('FLASK_ENV', 'production') != 'development':
+
+
+# Inicializar scheduler al cargar la app (para Gunicorn). Las tablas las prepara inicializar_bd();
+# CUZONET_SCHEDULER=0 importa la app sin arrancar el scheduler
+try:
+    if os.getenv('CUZONET_SCHEDULER', '1') == '1' and (
+            os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or os.getenv('FLASK_ENV', 'production') != 'development'):
         iniciar_scheduler()
 except Exception as e:
     print("Error en inicialización (DB o Scheduler):", e)
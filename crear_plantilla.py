@@ -2,7 +2,8 @@
 Script para crear plantilla Excel de importación de clientes
 """
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.styles.fonts import DEFAULT_FONT
 from openpyxl.utils import get_column_letter
 
 # Crear workbook
@@ -37,13 +38,14 @@ thin_border = Border(
     bottom=Side(style='thin')
 )
 
+# Estilo con nombre: se registra una vez y cada celda solo guarda la referencia
+estilo_encabezado = NamedStyle(name="encabezado", font=header_font, fill=header_fill,
+                               alignment=header_alignment, border=thin_border)
+wb.add_named_style(estilo_encabezado)
+
 # Escribir encabezados
 for col_num, (field, header, width) in enumerate(columnas, 1):
-    cell = ws.cell(row=1, column=col_num, value=header)
-    cell.font = header_font
-    cell.fill = header_fill
-    cell.alignment = header_alignment
-    cell.border = thin_border
+    ws.cell(row=1, column=col_num, value=header).style = "encabezado"
     ws.column_dimensions[get_column_letter(col_num)].width = width
 
 # Agregar datos de ejemplo
@@ -56,13 +58,12 @@ ejemplos = [
 # Estilos para datos
 data_alignment = Alignment(horizontal="left", vertical="center")
 example_fill = PatternFill(start_color="E8F4FD", end_color="E8F4FD", fill_type="solid")
+wb.add_named_style(NamedStyle(name="ejemplo", font=DEFAULT_FONT, alignment=data_alignment,
+                              border=thin_border, fill=example_fill))
 
 for row_num, ejemplo in enumerate(ejemplos, 2):
     for col_num, valor in enumerate(ejemplo, 1):
-        cell = ws.cell(row=row_num, column=col_num, value=valor)
-        cell.alignment = data_alignment
-        cell.border = thin_border
-        cell.fill = example_fill
+        ws.cell(row=row_num, column=col_num, value=valor).style = "ejemplo"
 
 # Agregar hoja de instrucciones
 ws_inst = wb.create_sheet("Instrucciones")
@@ -93,11 +94,9 @@ instrucciones = [
     ("  5. Si no conoce la velocidad, use valores como: 5M, 10M, 20M", ""),
 ]
 
-for row_num, (col1, col2) in enumerate(instrucciones, 1):
-    ws_inst.cell(row=row_num, column=1, value=col1)
-    ws_inst.cell(row=row_num, column=2, value=col2)
-    if row_num == 1:
-        ws_inst.cell(row=row_num, column=1).font = Font(bold=True, size=14, color="667EEA")
+for col1, col2 in instrucciones:
+    ws_inst.append((col1, col2))
+ws_inst.cell(row=1, column=1).font = Font(bold=True, size=14, color="667EEA")
 
 ws_inst.column_dimensions['A'].width = 40
 ws_inst.column_dimensions['B'].width = 50
@@ -0,0 +1,51 @@
+"""Configuración de gunicorn (se carga sola desde el directorio de trabajo)"""
+import os
+import subprocess
+import sys
+import threading
+
+_INIT_OK = 'CUZONET_INIT_OK'
+
+
+def on_starting(server):
+    """Inicializa la base de datos una vez, en segundo plano, mientras arrancan los workers.
+
+    Corre en un proceso aparte y sin scheduler: importar app aquí dejaría el pool de
+    conexiones en el maestro, heredado por cada fork. No se espera a que termine para
+    no retrasar el bind del puerto (el health check de la plataforma).
+    """
+    env = dict(os.environ, CUZONET_INIT_DB='0', CUZONET_SCHEDULER='0')
+    proceso = subprocess.Popen(
+        [sys.executable, '-c', f'import app; app.inicializar_bd(); print({_INIT_OK!r}, flush=True)'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    def esperar():
+        # El éxito se lee de la salida y no del código de retorno: el maestro de gunicorn
+        # recoge (waitpid) a los hijos que terminan, y el código puede perderse
+        ok = False
+        for linea in proceso.stdout:
+            if linea.strip() == _INIT_OK:
+                ok = True
+            else:
+                sys.stdout.write(linea)
+        proceso.wait()
+        if not ok:
+            server.log.error('init_db falló; revisar la salida anterior')
+
+    threading.Thread(target=esperar, daemon=True).start()
+    # Los workers heredan la variable y no repiten init_db al importar app
+    os.environ['CUZONET_INIT_DB'] = '0'
+
+
+def post_worker_init(worker):
+    """Precalienta mappers y sentencias en cada worker (la caché de SQLAlchemy es por proceso)"""
+    try:
+        from app import app, calentar_consultas
+        with app.app_context():
+            calentar_consultas()
+    except Exception as e:
+        worker.log.warning('No se pudo precalentar consultas: %s', e)